@@ -0,0 +1,1342 @@
+'''
+P0 Code Generator for WASM with an abstract syntax tree
+
+Instead of emitting code while the source is parsed, this code generator builds an abstract
+syntax tree of the program from the same gen-prefixed procedures that P0 calls for CGwat.
+When the program is complete, genProgExit(x) applies the passes in passes to the tree, which
+can transform it with knowledge of the whole program, and lowers the tree to WebAssembly by
+calling the procedures of CGwat in the order in which P0 would have called them; the result
+is the module in textual form. Without passes, the result is the same as that of CGwat, 
+except that operands and addresses in memory are loaded as soon as they are evaluated.
+
+Errors in the code generator are reported by calling mark of the scanner. The checks of
+CGwat that depend on the declarations are done while the tree is built, such that errors are
+reported at the location of the source where they occur.
+'''
+
+import nbimporter; nbimporter.options["only_defs"] = False
+import SC
+from SC import TIMES, DIV, MOD, AND, PLUS, MINUS, OR, EQ, NE, LT, GT, LE, \
+     GE, NOT, mark, TILDE, AMP, BAR
+from ST import indent, Var, Ref, Const, Int, Bool, Array, Record
+import CGwat
+
+'''
+The expressions of the tree are Const objects of the symbol table or objects of following
+classes, which all have a field tp for the type of the expression:
+
+-Name(entry) for the variable or parameter entry of the symbol table
+-Index(x, y) for x[y]
+-Select(x, f) for x.f, where f is the field of the record type of x
+-Unary(op, x) for op x, where op is MINUS, NOT, TILDE
+-Binary(op, x, y) for x op y, where op is an arithmetic operator, AND, OR or a relation
+-Address(x) for the address of x in memory, which passes introduce: a local Ref variable
+ with the same name as a local Int variable, to which an address is assigned, refers to the
+ memory at that address
+-Check(x, array) for the index x of an array of type array, if checks are enabled: the 
+ value is x, but evaluating it traps if x is not within the bounds of the array
+'''
+
+class Name:
+    __slots__ = ('tp', 'entry')
+    def __init__(self, entry):
+        self.tp, self.entry = entry.tp, entry
+    def __str__(self):
+        return self.entry.name
+
+class Index:
+    __slots__ = ('tp', 'x', 'y')
+    def __init__(self, x, y):
+        self.tp, self.x, self.y = x.tp.base, x, y
+    def __str__(self):
+        return expr(self.x) + '[' + expr(self.y) + ']'
+
+class Select:
+    __slots__ = ('tp', 'x', 'f')
+    def __init__(self, x, f):
+        self.tp, self.x, self.f = f.tp, x, f
+    def __str__(self):
+        return expr(self.x) + '.' + self.f.name
+
+class Unary:
+    __slots__ = ('tp', 'op', 'x')
+    def __init__(self, op, x, tp):
+        self.tp, self.op, self.x = tp, op, x
+    def __str__(self):
+        return OPS[self.op] + '(' + expr(self.x) + ')'
+
+class Binary:
+    __slots__ = ('tp', 'op', 'x', 'y')
+    def __init__(self, op, x, y, tp):
+        self.tp, self.op, self.x, self.y = tp, op, x, y
+    def __str__(self):
+        return '(' + expr(self.x) + ' ' + OPS[self.op] + ' ' + expr(self.y) + ')'
+
+class Address:
+    __slots__ = ('tp', 'x')
+    def __init__(self, x):
+        self.tp, self.x = Int, x
+    def __str__(self):
+        return '@' + expr(self.x)
+
+class Check:
+    __slots__ = ('tp', 'x', 'array')
+    def __init__(self, x, array):
+        self.tp, self.x, self.array = Int, x, array
+    def __str__(self):
+        return 'check(' + expr(self.x) + ')'
+
+OPS = {TIMES: '*', DIV: 'div', MOD: 'mod', AND: 'and', PLUS: '+', MINUS: '-', OR: 'or',
+       EQ: '=', NE: '<>', LT: '<', GT: '>', LE: '<=', GE: '>=', NOT: 'not', TILDE: '~',
+       AMP: '&', BAR: '|'}
+
+def expr(x):
+    return str(x.val) if type(x) == Const else str(x)
+
+'''
+The statements of the tree are objects of following classes; sequences of statements are
+lists of statements:
+
+-Assign(x, y) for x := y
+-Call(pr, args) for a call of procedure pr with the list args of pairs of actual and
+ formal parameters
+-Read(x), Write(x), Writeln() for the standard procedures
+-If(x, then, els) for if x then then else els, where els is None if there is no else part
+-While(x, body) for while x do body
+-For(x, z, up, body) for for x := y to z do body, or downto if up is False, where x := y
+ is the preceding statement
+-ForIn(x, array, elems, counter, body) for for x in [elems] do body, where array is the
+ variable for the list and counter the variable for the index of the list
+-Case(sel, arms, els) for case sel of arms else els, where arms is the list of pairs of the
+ list of labels and the statements of a case, and els is None if there is no else part
+'''
+
+class Assign:
+    __slots__ = ('x', 'y')
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+    def __str__(self):
+        return expr(self.x) + ' := ' + expr(self.y)
+
+class Call:
+    __slots__ = ('pr', 'args')
+    def __init__(self, pr, args):
+        self.pr, self.args = pr, args
+    def __str__(self):
+        return self.pr.name + '(' + ', '.join(expr(a) for a, f in self.args) + ')'
+
+class Read:
+    __slots__ = ('x',)
+    def __init__(self, x):
+        self.x = x
+    def __str__(self):
+        return 'read(' + expr(self.x) + ')'
+
+class Write:
+    __slots__ = ('x',)
+    def __init__(self, x):
+        self.x = x
+    def __str__(self):
+        return 'write(' + expr(self.x) + ')'
+
+class Writeln:
+    __slots__ = ()
+    def __str__(self):
+        return 'writeln()'
+
+class If:
+    __slots__ = ('x', 'then', 'els')
+    def __init__(self, x):
+        self.x, self.then, self.els = x, [], None
+    def __str__(self):
+        return 'if ' + expr(self.x) + ' then\n' + block(self.then) + \
+               ('' if self.els is None else '\nelse\n' + block(self.els))
+
+class While:
+    __slots__ = ('x', 'body')
+    def __init__(self, x):
+        self.x, self.body = x, []
+    def __str__(self):
+        return 'while ' + expr(self.x) + ' do\n' + block(self.body)
+
+class For:
+    __slots__ = ('x', 'z', 'up', 'body')
+    def __init__(self, x, z, up):
+        self.x, self.z, self.up, self.body = x, z, up, []
+    def __str__(self):
+        return 'for ' + expr(self.x) + (' to ' if self.up else ' downto ') + \
+               expr(self.z) + ' do\n' + block(self.body)
+
+class ForIn:
+    __slots__ = ('x', 'array', 'elems', 'counter', 'body')
+    def __init__(self, x, array, elems, counter):
+        self.x, self.array, self.elems, self.counter, self.body = x, array, elems, counter, []
+    def __str__(self):
+        return 'for ' + expr(self.x) + ' in [' + ', '.join(expr(e) for e in self.elems) + \
+               '] do\n' + block(self.body)
+
+class Case:
+    __slots__ = ('sel', 'arms', 'els')
+    def __init__(self, sel):
+        self.sel, self.arms, self.els = sel, [], None
+    def __str__(self):
+        return 'case ' + expr(self.sel) + ' of\n' + \
+               '\n'.join(indent(', '.join(str(l.val) for l in labels) + ':\n' + block(s))
+                         for labels, s in self.arms) + \
+               ('' if self.els is None else '\nelse\n' + block(self.els))
+
+def block(s):
+    return indent('\n'.join(str(t) for t in s))
+
+'''
+Procedures exprs(t) and bodies(t) return the list of the expressions of statement t, not
+including those of nested statements, and the list of the lists of its nested statements.
+Procedure statements(s) yields all statements of s, including nested ones, and procedure 
+subexprs(x) yields all subexpressions of expression x, including x.
+'''
+
+def exprs(t):
+    if type(t) == Assign: return [t.x, t.y]
+    elif type(t) == Call: return [a for a, f in t.args]
+    elif type(t) in (Read, Write, If, While): return [t.x]
+    elif type(t) == For: return [t.x, t.z]
+    elif type(t) == ForIn: return [t.x] + t.elems
+    elif type(t) == Case: return [t.sel]
+    else: return []
+
+def bodies(t):
+    if type(t) == If: return [t.then] + ([] if t.els is None else [t.els])
+    elif type(t) in (While, For, ForIn): return [t.body]
+    elif type(t) == Case: return [u for labels, u in t.arms] + ([] if t.els is None else [t.els])
+    else: return []
+
+def statements(s):
+    for t in s:
+        yield t
+        for u in bodies(t): yield from statements(u)
+
+def subexprs(x):
+    yield x
+    if type(x) in (Index, Select, Unary, Binary, Address, Check): yield from subexprs(x.x)
+    if type(x) in (Index, Binary): yield from subexprs(x.y)
+
+'''
+The program and each procedure are represented by objects of class Routine with fields:
+
+-name, the name of the program or procedure
+-params, the list of the entries of the parameters
+-vars, the list of the entries of the declared variables
+-body, the list of statements
+-procs, the list of the declared procedures, which is empty for a procedure
+-temps, the list of the entries of local variables introduced by passes
+'''
+
+class Routine:
+    def __init__(self, name, params):
+        self.name, self.params, self.vars, self.body, self.procs = name, params, [], [], []
+        self.temps = []
+    def __str__(self):
+        return ''.join(str(p) for p in self.procs) + self.name + \
+               '(' + ', '.join(p.name for p in self.params) + ')\n' + \
+               ''.join(indent('var ' + v.name) + '\n' for v in self.vars + self.temps) + \
+               'begin\n' + block(self.body) + '\nend\n'
+
+'''
+Following variables determine the state of the code generator while the tree is built:
+
+-curlev is the current level of nesting of P0 procedures, as in CGwat
+-prog is the Routine of the program and routine the Routine under construction
+-stats is the stack of the lists of statements under construction; statements are
+ appended to the last one
+-temps is the number of local variables introduced by passes
+Procedure genProgStart() initializes these variables.
+'''
+
+def genProgStart():
+    global curlev, prog, routine, stats, temps
+    curlev, prog, temps = 0, Routine('program', []), 0
+    routine, stats = prog, [prog.body]
+
+'''
+The types are the same as for CGwat.
+'''
+
+def genBool(b): return CGwat.genBool(b)
+
+def genInt(i): return CGwat.genInt(i)
+
+def genRec(r): return CGwat.genRec(r)
+
+def genArray(a): return CGwat.genArray(a)
+
+'''
+Procedures genGlobalVars(sc, start) and genLocalVars(sc, start) add the variables of sc
+from index start on to the current routine.
+'''
+
+def genGlobalVars(sc, start):
+    routine.vars.extend(e for e in sc[start:] if type(e) == Var)
+
+def genLocalVars(sc, start):
+    for e in sc[start:]:
+        if type(e) == Var:
+            if type(e.tp) in (Array, Record): mark('WASM: no local arrays, records')
+            routine.vars.append(e)
+
+def genProgEntry(ident):
+    global curlev
+    curlev = 1
+
+def genProcStart(ident, fp):
+    global curlev, routine, stats
+    if curlev > 0: mark('WASM: no nested procedures')
+    curlev = curlev + 1
+    for p in fp:
+        if p.tp in (Int, Bool) and type(p) == Ref:
+            mark('WASM: only array and record reference parameters')
+        elif type(p.tp) in (Array, Record) and type(p) == Var:
+            mark('WASM: no structured value parameters')
+    routine = Routine(ident, list(fp)); prog.procs.append(routine)
+    stats = [routine.body]
+
+def genProcEntry(ident, parsize, localsize):
+    pass
+
+def genProcExit(x, parsize, localsize):
+    global curlev, routine, stats
+    curlev = curlev - 1
+    routine, stats = prog, [prog.body]
+
+'''
+The expressions returned to P0 are Var, Ref and Const objects, as those of CGwat, where
+the Var and Ref objects have a field node with the expression of the tree. Procedure
+item(x, kind) returns an object of class kind for expression x; procedure node(x) returns
+the expression of the tree for object x.
+'''
+
+def item(x, kind = Var):
+    y = kind(x.tp); y.node = x
+    return y
+
+def node(x):
+    return Const(x.tp, x.val) if type(x) == Const else x.node
+
+def genVar(x):
+    if 0 < x.lev < curlev: mark('WASM: level!')
+    return item(Name(x), type(x))
+
+def genConst(x):
+    return x
+
+def genSelect(x, f):
+    return item(Select(node(x), f), type(x))
+
+def genIndex(x, y):
+    return item(Index(node(x), node(y)), Var if type(x) == Var and type(y) == Const else Ref)
+
+def genCheck(x, y):
+    return item(Check(node(y), x.tp))
+
+def genUnaryOp(op, x):
+    if op in (AND, OR): return x # the operation is completed by genBinaryOp
+    return item(Unary(op, node(x), Bool if op == NOT else Int))
+
+def genBinaryOp(op, x, y):
+    return item(Binary(op, node(x), node(y), Bool if op in (AND, OR) else Int))
+
+def genRelation(op, x, y):
+    return item(Binary(op, node(x), node(y), Bool))
+
+'''
+Statements are appended to the current list of statements; structured statements push
+the lists of their statements on stats and pop them at their end.
+'''
+
+def genAssign(x, y):
+    stats[-1].append(Assign(node(x), node(y)))
+
+def genActualPara(ap, fp, n):
+    return (node(ap), fp)
+
+def genCall(pr, ap):
+    stats[-1].append(Call(pr, ap))
+
+def genRead(x):
+    stats[-1].append(Read(node(x)))
+
+def genWrite(x):
+    stats[-1].append(Write(node(x)))
+
+def genWriteln():
+    stats[-1].append(Writeln())
+
+def genSeq(x, y):
+    pass
+
+def genThen(x):
+    s = If(node(x)); stats[-1].append(s); stats.append(s.then)
+    return x
+
+def genIfThen(x, y):
+    stats.pop()
+
+def genElse(x, y):
+    stats.pop(); s = stats[-1][-1]; s.els = []; stats.append(s.els)
+
+def genIfElse(x, y, z):
+    stats.pop()
+
+def genWhile():
+    pass
+
+def genDo(x):
+    s = While(node(x)); stats[-1].append(s); stats.append(s.body)
+    return x
+
+def genWhileDo(t, x, y):
+    stats.pop()
+
+def genForTo(x, z, up):
+    s = For(node(x), node(z), up); stats[-1].append(s); stats.append(s.body)
+    return z
+
+def genForNext(x, z, up):
+    stats.pop()
+
+def genForArray(array, inputList):
+    global elems
+    elems = [node(e) for e in inputList]
+
+def genForInit(x, array, counter, ArrayLength):
+    s = ForIn(node(x), array, elems, counter); stats[-1].append(s); stats.append(s.body)
+
+def genForEnd():
+    stats.pop()
+
+def genCaseInit(x):
+    s = Case(node(x)); stats[-1].append(s)
+    return s
+
+def genCaseArm(c, labels):
+    values = {int(l.val) for ls, t in c.arms for l in ls}; unique = []
+    for l in labels:
+        if int(l.val) in values: mark('multiple case label')
+        else: values.add(int(l.val)); unique.append(Const(l.tp, l.val))
+    c.arms.append((unique, [])); stats.append(c.arms[-1][1])
+
+def genCaseArmEnd(c):
+    stats.pop()
+
+def genCaseElse(c):
+    c.els = []; stats.append(c.els)
+
+def genCaseEnd(c):
+    if c.els is not None: stats.pop()
+
+'''
+Procedure genProgExit(x) applies the passes to the program and returns the lowered module,
+unless an error has been reported. Variable passes is the list of the names of the passes
+to be applied in order; PASSES maps the names of the passes to procedures that take the
+program as parameter and transform it in place.
+'''
+
+def genProgExit(x):
+    if SC.error: return None
+    for p in passes: PASSES[p](prog)
+    return lower(prog)
+
+'''
+Procedure lower(p) generates code for program p with CGwat; procedures lowerExpr(x) and
+lowerStats(s) generate code for expression x and the list s of statements. Expressions are
+lowered depth-first from left to right, such that the code of the operands is generated in
+the same order as when P0 calls CGwat, except that procedure operand(x) loads the first
+operand x of a binary operation before the code of the second operand is generated, such that
+CGwat does not need to reorder the operands; -x is generated as 0 - x in the same way. The
+address of a memory Var is a constant and that of a Ref is the value of the Ref as Int. 
+Procedure target(x) loads the address of the target x of an assignment or read before the
+value is generated, if x is stored in memory.
+'''
+
+def lower(p):
+    CGwat.genProgStart()
+    CGwat.genGlobalVars(p.vars, 0)
+    for r in p.procs:
+        CGwat.genProcStart(r.name, r.params)
+        CGwat.genLocalVars(r.vars + r.temps, 0)
+        CGwat.genProcEntry(r.name, 0, 0)
+        lowerStats(r.body)
+        CGwat.genProcExit(None, 0, 0)
+    CGwat.genProgEntry(p.name)
+    CGwat.genLocalVars(p.temps, 0)
+    lowerStats(p.body)
+    return CGwat.genProgExit(None)
+
+def lowerExpr(x):
+    if type(x) == Const: return CGwat.genConst(Const(x.tp, x.val))
+    elif type(x) == Name: return CGwat.genVar(x.entry)
+    elif type(x) == Index and type(x.y) == Check:
+        y = lowerExpr(x.x); return CGwat.genIndex(y, CGwat.genCheck(y, lowerExpr(x.y.x)))
+    elif type(x) == Index:
+        y = lowerExpr(x.x); return CGwat.genIndex(y, lowerExpr(x.y))
+    elif type(x) == Select: return CGwat.genSelect(lowerExpr(x.x), x.f)
+    elif type(x) == Unary and x.op == MINUS:
+        y = operand(Const(Int, 0)); return CGwat.genBinaryOp(MINUS, y, lowerExpr(x.x))
+    elif type(x) == Unary: return CGwat.genUnaryOp(x.op, lowerExpr(x.x))
+    elif type(x) == Address:
+        y = lowerExpr(x.x)
+        if type(y) == Var: return Const(Int, y.adr) # memory Var
+        z = Var(Int); z.lev = y.lev # local Ref or stack Ref
+        if y.lev > 0: z.name = y.name
+        return z
+    elif x.op in (AND, OR):
+        y = CGwat.genUnaryOp(x.op, lowerExpr(x.x))
+        return CGwat.genBinaryOp(x.op, y, lowerExpr(x.y))
+    elif x.op in (EQ, NE, LT, GT, LE, GE):
+        y = operand(x.x); return CGwat.genRelation(x.op, y, lowerExpr(x.y))
+    else:
+        y = operand(x.x); return CGwat.genBinaryOp(x.op, y, lowerExpr(x.y))
+
+def operand(x):
+    CGwat.loadItem(lowerExpr(x))
+    y = Var(x.tp); y.lev = -1
+    return y
+
+def target(x):
+    return CGwat.loadAddress(x) if x.lev == -2 or type(x) == Ref and x.lev > 0 else x
+
+def lowerStats(s):
+    for t in s:
+        if type(t) == Assign:
+            x = target(lowerExpr(t.x)); CGwat.genAssign(x, lowerExpr(t.y))
+        elif type(t) == Call:
+            ap = [CGwat.genActualPara(lowerExpr(a), f, i) for i, (a, f) in enumerate(t.args)]
+            CGwat.genCall(t.pr, ap)
+        elif type(t) == Read: CGwat.genRead(target(lowerExpr(t.x)))
+        elif type(t) == Write: CGwat.genWrite(lowerExpr(t.x))
+        elif type(t) == Writeln: CGwat.genWriteln()
+        elif type(t) == If:
+            x = CGwat.genThen(lowerExpr(t.x)); lowerStats(t.then)
+            if t.els is None: CGwat.genIfThen(x, None)
+            else:
+                CGwat.genElse(x, None); lowerStats(t.els); CGwat.genIfElse(x, None, None)
+        elif type(t) == While:
+            w = CGwat.genWhile(); x = CGwat.genDo(lowerExpr(t.x))
+            lowerStats(t.body); CGwat.genWhileDo(w, x, None)
+        elif type(t) == For:
+            x = lowerExpr(t.x); z = CGwat.genForTo(x, lowerExpr(t.z), t.up)
+            lowerStats(t.body); CGwat.genForNext(lowerExpr(t.x), z, t.up)
+        elif type(t) == ForIn:
+            CGwat.genForArray(t.array, [lowerExpr(e) for e in t.elems])
+            CGwat.genForInit(lowerExpr(t.x), t.array, t.counter, len(t.elems))
+            lowerStats(t.body); CGwat.genForEnd()
+        elif type(t) == Case:
+            c = CGwat.genCaseInit(lowerExpr(t.sel))
+            for labels, u in t.arms:
+                CGwat.genCaseArm(c, labels); lowerStats(u); CGwat.genCaseArmEnd(c)
+            if t.els is not None: CGwat.genCaseElse(c); lowerStats(t.els)
+            CGwat.genCaseEnd(c)
+
+'''
+Pass fold evaluates operations on constants and removes statements that cannot be executed:
+the branches of if and case statements that are not taken for constant conditions and
+selectors, and while statements with the constant condition false. The evaluation of
+constants follows WebAssembly, where integers have 32 bits and div and mod truncate;
+divisions by 0 are not evaluated, so they trap at run time, as do checks of constant indices
+that are not within the bounds of the array, which are not removed.
+'''
+
+def i32(n):
+    return (n + 2**31) % 2**32 - 2**31
+
+def evaluate(op, a, b):
+    if op == TIMES: return i32(a * b)
+    elif op == DIV: return i32(abs(a) // abs(b) * (-1 if (a < 0) != (b < 0) else 1))
+    elif op == MOD: return i32(abs(a) % abs(b) * (-1 if a < 0 else 1))
+    elif op == PLUS: return i32(a + b)
+    elif op == MINUS: return i32(a - b)
+    elif op == AMP: return a & b
+    elif op == BAR: return a | b
+    elif op == EQ: return int(a == b)
+    elif op == NE: return int(a != b)
+    elif op == LT: return int(a < b)
+    elif op == GT: return int(a > b)
+    elif op == LE: return int(a <= b)
+    elif op == GE: return int(a >= b)
+
+def foldExpr(x, env = {}):
+    if type(x) == Name: return Const(x.tp, env[x.entry]) if x.entry in env else x
+    if type(x) in (Index, Select, Unary, Binary, Address, Check): x.x = foldExpr(x.x, env)
+    if type(x) in (Index, Binary): x.y = foldExpr(x.y, env)
+    if type(x) == Unary and type(x.x) == Const:
+        a = int(x.x.val)
+        return Const(x.tp, 1 - a if x.op == NOT else i32(-a) if x.op == MINUS else ~a)
+    elif type(x) == Binary and type(x.x) == Const:
+        a = int(x.x.val)
+        if x.op == AND: return x.y if a else x.x
+        elif x.op == OR: return x.x if a else x.y
+        elif type(x.y) == Const and not (x.op in (DIV, MOD) and int(x.y.val) == 0):
+            return Const(x.tp, evaluate(x.op, a, int(x.y.val)))
+    elif type(x) == Check and type(x.x) == Const and \
+         0 <= int(x.x.val) - x.array.lower < x.array.length: return x.x
+    return x
+
+def foldTarget(x, env):
+    return x if type(x) == Name else foldExpr(x, env or {})
+
+def foldStats(s, env = None):
+    r = []
+    for t in s:
+        if type(t) == Assign:
+            t.x, t.y = foldTarget(t.x, env), foldExpr(t.y, env or {})
+            if env is not None: setValue(env, t.x, t.y)
+        elif type(t) == Read:
+            t.x = foldTarget(t.x, env)
+            if env is not None: setValue(env, t.x, None)
+        elif type(t) == Write: t.x = foldExpr(t.x, env or {})
+        elif type(t) == Call:
+            t.args = [(foldExpr(a, env or {}), f) for a, f in t.args]
+            if env is not None: kill(env, [t])
+        elif type(t) == If:
+            t.x = foldExpr(t.x, env or {})
+            if type(t.x) == Const:
+                r.extend(foldStats(t.then if t.x.val else t.els or [], env)); continue
+            e = copy(env); t.then = foldStats(t.then, e)
+            if t.els is not None: t.els = foldStats(t.els, env)
+            merge(env, [e])
+        elif type(t) == While:
+            kill(env, t.body); t.x = foldExpr(t.x, env or {})
+            if type(t.x) == Const and not t.x.val: continue
+            t.body = foldStats(t.body, copy(env))
+        elif type(t) in (For, ForIn):
+            if type(t) == For: t.z = foldExpr(t.z, env or {})
+            else: t.elems = [foldExpr(e, env or {}) for e in t.elems]
+            kill(env, t.body); setValue(env, t.x, None)
+            t.body = foldStats(t.body, copy(env))
+        elif type(t) == Case:
+            t.sel = foldExpr(t.sel, env or {})
+            if type(t.sel) == Const:
+                u = [u for labels, u in t.arms if any(l.val == t.sel.val for l in labels)]
+                r.extend(foldStats(u[0] if u else t.els or [], env)); continue
+            es = [copy(env) for a in t.arms]
+            t.arms = [(labels, foldStats(u, e)) for (labels, u), e in zip(t.arms, es)]
+            if t.els is not None: t.els = foldStats(t.els, env)
+            merge(env, es)
+        r.append(t)
+    return r
+
+def fold(p):
+    for r in p.procs + [p]: r.body = foldStats(r.body)
+
+'''
+Pass constprop propagates the values of variables that are known to be constant, like 
+fold, which it includes. Procedure foldStats(s, env) also tracks the values of the Int and 
+Bool variables in the dictionary env from variables to their values, if env is not None: 
+env holds the values that are known before s and is updated to those known after s. After 
+an if or case statement, only values that are known in all branches are known; a loop is 
+entered with the values of the variables that are not assigned in the loop, and a call 
+forgets the values of the global variables, which is found by procedure kill(env, s). 
+Procedures copy(env), merge(env, es), setValue(env, x, y) do nothing if env is None.
+'''
+
+def copy(env):
+    return None if env is None else dict(env)
+
+def merge(env, es):
+    if env is not None:
+        for v in list(env):
+            if any(e.get(v, None) != env[v] for e in es): del env[v]
+
+def setValue(env, x, y):
+    if env is not None and type(x) == Name:
+        if type(y) == Const and type(x.entry) == Var and x.tp in (Int, Bool):
+            env[x.entry] = int(y.val)
+        else: env.pop(x.entry, None)
+
+def assigned(s):
+    vs = set()
+    for t in statements(s):
+        if type(t) in (Assign, Read, For, ForIn) and type(t.x) == Name: vs.add(t.x.entry)
+        elif type(t) == Call: vs.update(prog.vars)
+    return vs
+
+def kill(env, s):
+    if env is not None:
+        for v in assigned(s): env.pop(v, None)
+
+def constprop(p):
+    for r in p.procs + [p]: r.body = foldStats(r.body, {})
+
+'''
+Pass deadcode removes the procedures that are not called from the program, directly or
+indirectly, and the global variables that are not referred to in the program or the 
+remaining procedures, such that neither WebAssembly functions and global variables nor
+memory are allocated for them.
+'''
+
+def deadcode(p):
+    procs, live, work = {r.name: r for r in p.procs}, set(), [p]
+    while work:
+        for t in statements(work.pop().body):
+            if type(t) == Call and t.pr.name not in live:
+                live.add(t.pr.name); work.append(procs[t.pr.name])
+    p.procs = [r for r in p.procs if r.name in live]
+    used = {x.entry for r in p.procs + [p] for t in statements(r.body)
+            for e in exprs(t) for x in subexprs(e) if type(x) == Name}
+    p.vars = [v for v in p.vars if v in used]
+
+'''
+Pass inline replaces calls of procedures that are not recursive and small by the body of 
+the procedure. The size of a procedure is the number of statements and subexpressions of its
+body. A call is inlined if the size is at most inlineSize, or at most inlineLoopSize if the 
+call is in a loop or the only call of the procedure. Procedures can only call procedures
+declared before them or themselves, so if the procedures are processed in the order of their
+declaration, the calls in the inlined bodies have already been inlined.
+
+The parameters and local variables of the procedure are replaced by new local variables of
+the calling routine, added to its temps, as are the variables that inlining added to the
+procedure; value parameters are assigned the actual parameters and local variables are 
+assigned 0, as in WebAssembly, unless they are assigned before being used. Reference 
+parameters are replaced by the actual parameters, which is only possible if the address of
+the actual parameter is the same throughout the body: if it is a variable or reference 
+parameter, possibly with fields and constant indices. Procedure fresh(r, tp, prefix, suffix)
+returns a new local variable of routine r with type tp; the names of new variables contain
+underscores, so they are distinct from P0 identifiers. Procedure pointer(r, x, prefix) 
+returns the assignment of the address of x to a new local variable of r and the local Ref
+through which x is accessed.
+'''
+
+inlineSize, inlineLoopSize = 20, 60
+
+def size(s):
+    return sum(1 + sum(1 for e in exprs(t) for x in subexprs(e)) for t in statements(s))
+
+def fresh(r, tp, prefix, suffix = ''):
+    global temps
+    w = Var(tp); w.lev, w.name, temps = 1, prefix + '_' + str(temps) + suffix, temps + 1
+    r.temps.append(w)
+    return w
+
+def pointer(r, x, prefix):
+    v = fresh(r, Int, prefix); w = Ref(x.tp); w.lev, w.name = v.lev, v.name
+    return Assign(Name(v), Address(x)), Name(w)
+
+def stable(x):
+    if type(x) == Name: return True
+    elif type(x) == Select: return stable(x.x)
+    elif type(x) == Index: return type(x.y) == Const and stable(x.x)
+    else: return False
+
+def initialized(s, v):
+    for t in s:
+        if any(type(x) == Name and x.entry == v for u in statements([t]) for e in exprs(u)
+               for x in subexprs(e) if not (type(u) == Assign and e is u.x and x is e)):
+            return False
+        elif type(t) == Assign and type(t.x) == Name and t.x.entry == v: return True
+    return True
+
+def cloneExpr(x, m):
+    if type(x) == Name: return m[x.entry] if x.entry in m else x
+    elif type(x) == Index: return Index(cloneExpr(x.x, m), cloneExpr(x.y, m))
+    elif type(x) == Select: return Select(cloneExpr(x.x, m), x.f)
+    elif type(x) == Unary: return Unary(x.op, cloneExpr(x.x, m), x.tp)
+    elif type(x) == Binary: return Binary(x.op, cloneExpr(x.x, m), cloneExpr(x.y, m), x.tp)
+    elif type(x) == Address: return Address(cloneExpr(x.x, m))
+    elif type(x) == Check: return Check(cloneExpr(x.x, m), x.array)
+    else: return x
+
+def cloneStats(s, m, r):
+    c = []
+    for t in s:
+        if type(t) == Assign: u = Assign(cloneExpr(t.x, m), cloneExpr(t.y, m))
+        elif type(t) == Call: u = Call(t.pr, [(cloneExpr(a, m), f) for a, f in t.args])
+        elif type(t) in (Read, Write): u = type(t)(cloneExpr(t.x, m))
+        elif type(t) == Writeln: u = Writeln()
+        elif type(t) == If:
+            u = If(cloneExpr(t.x, m)); u.then = cloneStats(t.then, m, r)
+            if t.els is not None: u.els = cloneStats(t.els, m, r)
+        elif type(t) == While: u = While(cloneExpr(t.x, m)); u.body = cloneStats(t.body, m, r)
+        elif type(t) == For:
+            u = For(cloneExpr(t.x, m), cloneExpr(t.z, m), t.up); u.body = cloneStats(t.body, m, r)
+        elif type(t) == ForIn:
+            array = Var(t.array.tp)
+            counter = fresh(r, t.counter.tp, 'inline', '_' + t.counter.name)
+            array.lev, array.name = t.array.lev, t.array.name
+            u = ForIn(cloneExpr(t.x, m), array, [cloneExpr(e, m) for e in t.elems], counter)
+            r.temps.remove(counter) # declared by CGwat.genForInit
+            u.body = cloneStats(t.body, m, r)
+        elif type(t) == Case:
+            u = Case(cloneExpr(t.sel, m))
+            u.arms = [(labels, cloneStats(b, m, r)) for labels, b in t.arms]
+            if t.els is not None: u.els = cloneStats(t.els, m, r)
+        c.append(u)
+    return c
+
+def inlineCall(t, q, r):
+    m, s = {}, []
+    for (a, f), v in zip(t.args, q.params):
+        if type(v) == Ref: m[v] = a
+        else: m[v] = Name(fresh(r, v.tp, 'inline', '_' + v.name)); s.append(Assign(m[v], a))
+    for v in q.vars + q.temps:
+        m[v] = Name(fresh(r, v.tp, 'inline', '_' + v.name))
+        if not initialized(q.body, v): s.append(Assign(m[v], Const(v.tp, 0)))
+    return s + cloneStats(q.body, m, r)
+
+def inlineStats(s, r, procs, calls, loop):
+    n = []
+    for t in s:
+        if type(t) == If:
+            t.then = inlineStats(t.then, r, procs, calls, loop)
+            if t.els is not None: t.els = inlineStats(t.els, r, procs, calls, loop)
+        elif type(t) in (While, For, ForIn): t.body = inlineStats(t.body, r, procs, calls, True)
+        elif type(t) == Case:
+            t.arms = [(labels, inlineStats(u, r, procs, calls, loop)) for labels, u in t.arms]
+            if t.els is not None: t.els = inlineStats(t.els, r, procs, calls, loop)
+        elif type(t) == Call and t.pr.name in procs:
+            q = procs[t.pr.name]; k = size(q.body)
+            if all(stable(a) for (a, f), v in zip(t.args, q.params) if type(v) == Ref) and \
+               (k <= inlineSize or k <= inlineLoopSize and (loop or calls[q.name] == 1)):
+                n.extend(inlineCall(t, q, r)); continue
+        n.append(t)
+    return n
+
+def inline(p):
+    calls = {}
+    for r in p.procs + [p]:
+        for t in statements(r.body):
+            if type(t) == Call: calls[t.pr.name] = calls.get(t.pr.name, 0) + 1
+    procs = {}
+    for r in p.procs + [p]:
+        r.body = inlineStats(r.body, r, procs, calls, False)
+        if not any(type(t) == Call and t.pr.name == r.name for t in statements(r.body)):
+            procs[r.name] = r
+
+'''
+Pass licm moves computations that yield the same value in each iteration of a loop in front
+of the loop, where the value is assigned to a new local variable of the routine. An 
+expression is invariant in a loop if the variables it refers to are not assigned in the loop
+and, if it loads from memory, the loop neither stores to memory nor calls procedures; a
+checked index is never invariant, such that checks stay in the loop, also for pass strength. 
+Operations with variable operands, global variables and loads from memory at a constant
+address are moved if they are invariant, unless they may trap, as the loop may not be
+executed: divisions by variables may trap, as may loads at a computed address or at a 
+constant index out of bounds, which constant propagation may have produced. Of an element of
+an array at a computed address, only the address is moved, and the element is accessed 
+through a local Ref variable. Loops are processed from the outside in, such that expressions
+are moved out of as many loops as possible.
+
+Objects of class Loop keep for the loop that is processed:
+
+-names, the names of the variables that are assigned in the loop
+-stores, whether the loop stores to memory or calls procedures
+-pre, the list of assignments to the new variables, which are inserted before the loop
+-moved, a dictionary from the expressions that are moved, by key(x), to their new variables
+-r, the routine of the loop
+'''
+
+class Loop:
+    def __init__(self, t, r):
+        self.names = {v.name for v in assigned([t])}
+        self.stores = any(type(u) == Call or type(u) in (Assign, Read) and
+                          not (type(u.x) == Name and type(u.x.entry) == Var)
+                          for u in statements([t]))
+        self.pre, self.moved, self.r = [], {}, r
+
+def key(x):
+    if type(x) == Const: return int(x.val)
+    elif type(x) == Name: return x.entry
+    elif type(x) == Select: return (Select, key(x.x), x.f)
+    elif type(x) in (Unary, Address): return (type(x), getattr(x, 'op', None), key(x.x))
+    elif type(x) == Check: return (Check, key(x.x), x.array)
+    else: return (type(x), getattr(x, 'op', None), key(x.x), key(x.y))
+
+def invariant(x, h):
+    if type(x) == Const: return True
+    elif type(x) == Name:
+        return x.entry.name not in h.names and \
+               (type(x.entry) == Var or type(x.tp) in (Array, Record) or not h.stores)
+    elif type(x) in (Index, Select):
+        return invariant(x.x, h) and (type(x) == Select or invariant(x.y, h)) and \
+               (type(x.tp) in (Array, Record) or not h.stores)
+    elif type(x) in (Unary, Address): return invariant(x.x, h)
+    elif type(x) == Check: return False
+    else: return invariant(x.x, h) and invariant(x.y, h)
+
+def trapping(x, h):
+    return any(type(y) == Binary and y.op in (DIV, MOD) and
+               not (type(y.y) == Const and int(y.y.val) != 0) or
+               type(y) == Index and not (type(y.y) == Const and
+                                          0 <= int(y.y.val) - y.x.tp.lower < y.x.tp.length) or
+               type(y) == Name and type(y.entry) == Ref and y.entry not in h.r.params
+               for y in subexprs(x))
+
+def worthwhile(x):
+    if type(x) == Name: return type(x.entry) == Var and x.entry.lev == 0 and x.tp in (Int, Bool)
+    elif type(x) in (Index, Select): return x.tp in (Int, Bool)
+    else: return any(type(y) == Name for y in subexprs(x))
+
+'''
+Procedure hoist(x, h, load) returns expression x with the invariant computations replaced by 
+the new variables, where load tells whether x is loaded or is the target of an assignment;
+procedure hoistStats(s, h) does so for all expressions of the list s of statements, except 
+for targets of read and reference parameters, and procedure licmStats(s, r) for all loops
+of s, which are in routine r.
+'''
+
+def hoist(x, h, load = True):
+    if type(x) == Const: return x
+    elif load and invariant(x, h) and worthwhile(x) and not trapping(x, h):
+        if key(x) not in h.moved:
+            v = fresh(h.r, x.tp, 'licm'); h.moved[key(x)] = Name(v)
+            h.pre.append(Assign(Name(v), x))
+        return h.moved[key(x)]
+    if type(x) == Index: x.x, x.y = hoist(x.x, h, False), hoist(x.y, h)
+    elif type(x) == Select: x.x = hoist(x.x, h, False)
+    elif type(x) in (Unary, Check): x.x = hoist(x.x, h)
+    elif type(x) == Binary: x.x, x.y = hoist(x.x, h), hoist(x.y, h)
+    if type(x) == Index and type(x.y) != Const and invariant(x.x, h) and invariant(x.y, h):
+        k = key(Address(x))
+        if k not in h.moved:
+            a, h.moved[k] = pointer(h.r, x, 'licm'); h.pre.append(a)
+        return h.moved[k]
+    return x
+
+def hoistStats(s, h):
+    for t in s:
+        if type(t) == Assign: t.x, t.y = hoist(t.x, h, False), hoist(t.y, h)
+        elif type(t) == Call: t.args = [(a if type(f) == Ref else hoist(a, h), f) for a, f in t.args]
+        elif type(t) in (Write, If, While): t.x = hoist(t.x, h)
+        elif type(t) == For: t.z = hoist(t.z, h)
+        elif type(t) == ForIn: t.elems = [hoist(e, h) for e in t.elems]
+        elif type(t) == Case: t.sel = hoist(t.sel, h)
+        for u in bodies(t): hoistStats(u, h)
+
+def licmStats(s, r):
+    n = []
+    for t in s:
+        if type(t) in (While, For, ForIn):
+            h = Loop(t, r)
+            if type(t) == While: t.x = hoist(t.x, h)
+            hoistStats(t.body, h); n.extend(h.pre)
+        for u in bodies(t): u[:] = licmStats(u, r)
+        n.append(t)
+    return n
+
+def licm(p):
+    for r in p.procs + [p]: r.body = licmStats(r.body, r)
+
+'''
+Pass cse computes the address of an element of an array at a computed index only once in a
+basic block, a sequence of statements that is only entered at the beginning, if the address 
+is used more than once: the address is assigned to a new local variable before the statement
+with its first use and the element is accessed through a local Ref variable. A basic block 
+ends with a structured statement, of which the expressions that are evaluated before the
+branches or before the first iteration are part of the block.
+
+The addresses are compared by their keys, where key(x) is extended by the version of each
+variable that x refers to, which is incremented when the variable is assigned, and of the 
+memory, with key '', if x loads from memory, which is incremented when memory is stored or
+procedures are called. Procedure replace(x, f) calls f for the computed addresses in x, from
+the outside in, and replaces them by the result of f if that is not None; procedure
+replaceExprs(t, f) does so for the expressions of statement t, not including nested 
+statements, and procedure evaluation(t, f, versions) for those that are evaluated before the
+branches or iterations of t, in the order of their evaluation, and updates versions. The
+block is traversed three times: the first counts the uses of each address, the second those
+that are not part of a larger address that is used more than once, and the third replaces
+those used more than once.
+'''
+
+def replace(x, f):
+    if type(x) == Index and type(x.y) != Const:
+        y = f(x)
+        if y is not None: return y
+    if type(x) in (Index, Select, Unary, Binary, Address, Check): x.x = replace(x.x, f)
+    if type(x) in (Index, Binary): x.y = replace(x.y, f)
+    return x
+
+def version(x, versions):
+    vs = {y.entry.name for y in subexprs(x) if type(y) == Name}
+    if any(y is not x and y.tp in (Int, Bool) and
+           (type(y) in (Index, Select) or type(y) == Name and type(y.entry) == Ref)
+           for y in subexprs(x)): vs.add('')
+    return (key(x), tuple(sorted((v, versions.get(v, 0)) for v in vs)))
+
+def replaceExprs(t, f):
+    if type(t) == Assign: t.x, t.y = replace(t.x, f), replace(t.y, f)
+    elif type(t) == Call: t.args = [(replace(a, f), fp) for a, fp in t.args]
+    elif type(t) in (Read, Write, If, While): t.x = replace(t.x, f)
+    elif type(t) == For: t.z = replace(t.z, f)
+    elif type(t) == ForIn: t.elems = [replace(e, f) for e in t.elems]
+    elif type(t) == Case: t.sel = replace(t.sel, f)
+
+def evaluation(t, f, versions):
+    if type(t) != While: replaceExprs(t, f)
+    if type(t) in (Assign, Read):
+        v = t.x.entry.name if type(t.x) == Name and type(t.x.entry) == Var else ''
+        versions[v] = versions.get(v, 0) + 1
+    elif type(t) == Call:
+        for v in [''] + [v.name for v in prog.vars]: versions[v] = versions.get(v, 0) + 1
+
+def cseBlock(b, r):
+    uses, single, versions = {}, {}, {}
+    def count(x):
+        k = version(x, versions); uses[k] = uses.get(k, 0) + 1
+    for t in b: evaluation(t, count, versions)
+    def outer(x):
+        k = version(x, versions); single[k] = single.get(k, 0) + 1
+        return x if uses[k] > 1 else None
+    versions.clear()
+    for t in b: evaluation(t, outer, versions)
+    pointers, pre, n = {}, [], []
+    def common(x):
+        k = version(x, versions)
+        if single.get(k, 0) < 2: return None
+        if k not in pointers:
+            a, pointers[k] = pointer(r, x, 'cse'); pre.append(a)
+        return pointers[k]
+    versions.clear()
+    for t in b:
+        evaluation(t, common, versions); n.extend(pre); n.append(t); pre.clear()
+    return n
+
+def cseStats(s, r):
+    n, b = [], []
+    for t in s:
+        b.append(t)
+        if bodies(t):
+            n.extend(cseBlock(b, r)); b = []
+            for u in bodies(t): u[:] = cseStats(u, r)
+    n.extend(cseBlock(b, r))
+    return n
+
+def cse(p):
+    for r in p.procs + [p]: r.body = cseStats(r.body, r)
+
+'''
+Pass strength reduces the computation of the address of an element of an array in a loop to
+the increment of a pointer, if the element is indexed by an induction variable i of the loop:
+the counter of a for loop, which is not assigned in the body, or a variable that is assigned
+only once in the body of a while loop, by a statement i := i + c or i := i - c for a constant
+c. Of a designator, one index has to be i and the remaining indices and the array have to be
+invariant in the loop; procedure stride(x, i, h) returns then the size of the elements that 
+i indexes, otherwise None. Before the loop, the address of the element is assigned to a new
+local variable, through which the element is accessed in the loop; the variable is 
+incremented by c times the stride at the end of the body of a for loop and after the 
+assignment to i in a while loop. As an increment takes four instructions, a pointer is only
+introduced if the addresses it replaces take more than four instructions more than loading
+the pointer, where procedure cost(x) estimates the instructions for the address of x: two
+for the element of an array at a constant address, as the address is added as offset, and 
+four for each further index, plus two for an array accessed through a Ref and two for each
+lower bound that is not 0 and not added to a constant address.
+
+Procedure induction(t) returns the entry of the induction variable of loop t, the step of 
+the variable and the index of the statement of the body after which the pointers are 
+incremented, or None if t has no induction variable.
+'''
+
+def induction(t):
+    if type(t) == For:
+        if t.x.entry.name not in {v.name for v in assigned(t.body)}:
+            return t.x.entry, 1 if t.up else -1, len(t.body) - 1
+    elif type(t) == While:
+        for m, u in enumerate(t.body):
+            if type(u) == Assign and type(u.x) == Name and type(u.x.entry) == Var and \
+               type(u.y) == Binary and u.y.op in (PLUS, MINUS) and type(u.y.x) == Name and \
+               u.y.x.entry == u.x.entry and type(u.y.y) == Const and \
+               u.x.entry.name not in {v.name for v in assigned(t.body[:m] + t.body[m + 1:])}:
+                return u.x.entry, int(u.y.y.val) * (1 if u.y.op == PLUS else -1), m
+    return None
+
+def stride(x, i, h):
+    s = None
+    while type(x) in (Index, Select):
+        if type(x) == Index and type(x.y) == Name and x.y.entry == i:
+            if s is not None: return None
+            s = x.tp.size
+        elif type(x) == Index and not invariant(x.y, h): return None
+        x = x.x
+    return s if invariant(x, h) else None
+
+def cost(x):
+    c = 0
+    while type(x) in (Index, Select):
+        if type(x) == Index and type(x.y) != Const:
+            c += 4 + (2 if x.x.tp.lower != 0 and not stable(x.x) else 0)
+        x = x.x
+    return c - 2 if type(x.entry) == Var else c + 2
+
+def reduce(t, r):
+    v = induction(t)
+    if v is None: return []
+    i, step, m = v; h = Loop(t, r); saving = {}
+    def count(x):
+        if stride(x, i, h): saving[key(x)] = saving.get(key(x), 0) + cost(x) - 1
+    for u in statements(t.body): replaceExprs(u, count)
+    if type(t) == While: replaceExprs(t, count)
+    pointers, pre, incs = {}, [], []
+    def walk(x):
+        if saving.get(key(x), 0) > 4 and stride(x, i, h):
+            if key(x) not in pointers:
+                a, pointers[key(x)] = pointer(r, x, 'iv'); pre.append(a); w = a.x
+                incs.append(Assign(w, Binary(PLUS, w, Const(Int, step * stride(x, i, h)), Int)))
+            return pointers[key(x)]
+    for u in statements(t.body): replaceExprs(u, walk)
+    if type(t) == While: replaceExprs(t, walk)
+    t.body[m + 1:m + 1] = incs
+    return pre
+
+def strengthStats(s, r):
+    n = []
+    for t in s:
+        if type(t) in (While, For): n.extend(reduce(t, r))
+        for u in bodies(t): u[:] = strengthStats(u, r)
+        n.append(t)
+    return n
+
+def strength(p):
+    for r in p.procs + [p]: r.body = strengthStats(r.body, r)
+
+'''
+Pass bounds removes the checks of indices that are known to be within the bounds of the
+array, by a range analysis: an interval of the values that each Int variable may have is
+tracked through the statements of a routine, where the intervals are dictionaries from the
+entries of the variables to pairs of the lowest and highest value; a variable that is not
+in the dictionary may have any value. At the beginning of a routine, the local variables 
+and, for the program, the global variables are 0. The intervals are narrowed by the
+conditions of if and while statements in their branches and bodies, by the final value of 
+for statements in their bodies and by the checks that are passed, e.g. after a[i] is 
+checked, a check of b[i] is removed if b has the same bounds. Procedure interval(x, env) returns the interval of 
+expression x with intervals env of the variables; if the arithmetic may overflow, it 
+returns FULL. A loop is analysed repeatedly until the intervals at its beginning do not 
+change anymore; to ensure termination, a bound that changes is widened to the lowest or 
+highest integer.
+
+Procedure restrict(env, x, op, r) narrows the interval of variable x in env such that x op y
+holds for some y in interval r, for a relation op; procedure refine(env, x, truth) narrows 
+env such that condition x has the value truth, and procedures join(env, es) and widen(env, e) update 
+env to the intervals that include those of env and es, respectively e, where widen also 
+returns whether env changed.
+'''
+
+MININT, MAXINT = -2**31, 2**31 - 1
+FULL = (MININT, MAXINT)
+NEGATION = {EQ: NE, NE: EQ, LT: GE, GE: LT, GT: LE, LE: GT}
+
+def ranged(lo, hi):
+    return (lo, hi) if MININT <= lo and hi <= MAXINT else FULL
+
+def interval(x, env):
+    if type(x) == Const: return (int(x.val), int(x.val))
+    elif type(x) == Name and type(x.entry) == Var and x.tp == Int: return env.get(x.entry, FULL)
+    elif type(x) == Check:
+        lo, hi = interval(x.x, env)
+        return (max(lo, x.array.lower), min(hi, x.array.lower + x.array.length - 1))
+    elif type(x) == Unary and x.op == MINUS:
+        lo, hi = interval(x.x, env); return ranged(-hi, -lo)
+    elif type(x) == Binary and x.op in (PLUS, MINUS, TIMES, DIV, MOD, AMP):
+        (a, b), (c, d) = interval(x.x, env), interval(x.y, env)
+        if x.op == PLUS: return ranged(a + c, b + d)
+        elif x.op == MINUS: return ranged(a - d, b - c)
+        elif x.op == TIMES:
+            ps = (a * c, a * d, b * c, b * d); return ranged(min(ps), max(ps))
+        elif x.op == DIV and c == d != 0 and (a, c) != (MININT, -1):
+            q, r = evaluate(DIV, a, c), evaluate(DIV, b, c); return (min(q, r), max(q, r))
+        elif x.op == MOD and c == d != 0:
+            m = abs(c) - 1
+            return (0, min(b, m)) if a >= 0 else (-m, m if b >= 0 else 0)
+        elif x.op == AMP and (a >= 0 or c >= 0):
+            return (0, min(b if a >= 0 else MAXINT, d if c >= 0 else MAXINT))
+    elif x.tp == Bool: return (0, 1)
+    return FULL
+
+def restrict(env, x, op, r):
+    if type(x) == Name and type(x.entry) == Var and x.tp == Int:
+        (lo, hi), (a, b) = env.get(x.entry, FULL), r
+        if op == EQ: lo, hi = max(lo, a), min(hi, b)
+        elif op == LT: hi = min(hi, b - 1)
+        elif op == LE: hi = min(hi, b)
+        elif op == GT: lo = max(lo, a + 1)
+        elif op == GE: lo = max(lo, a)
+        elif op == NE and a == b: lo, hi = lo + (lo == a), hi - (hi == a)
+        env[x.entry] = (lo, hi)
+
+def refine(env, x, truth):
+    if type(x) == Unary and x.op == NOT: refine(env, x.x, not truth)
+    elif type(x) == Binary and x.op == (AND if truth else OR):
+        refine(env, x.x, truth); refine(env, x.y, truth)
+    elif type(x) == Binary and x.op in NEGATION:
+        op = x.op if truth else NEGATION[x.op]
+        restrict(env, x.x, op, interval(x.y, env))
+        restrict(env, x.y, CGwat.MIRROR[op], interval(x.x, env))
+
+def join(env, es):
+    for v in list(env):
+        if any(v not in e for e in es): del env[v]
+        else:
+            env[v] = (min([env[v][0]] + [e[v][0] for e in es]),
+                      max([env[v][1]] + [e[v][1] for e in es]))
+
+def widen(env, e):
+    changed = False
+    for v in list(env):
+        if v not in e: del env[v]; changed = True
+        elif e[v][0] < env[v][0] or e[v][1] > env[v][1]:
+            env[v] = (env[v][0] if e[v][0] >= env[v][0] else MININT,
+                      env[v][1] if e[v][1] <= env[v][1] else MAXINT); changed = True
+    return changed
+
+'''
+Procedure boundsExpr(x, env, final) narrows env by the checks of x in the order of their
+evaluation and returns x without the checks that are redundant, if final is True; the 
+right operand of and, or is evaluated only under the condition of the left operand, so its
+checks do not narrow env. A check that is passed narrows the variable i of an index i, 
+i + c or i - c for constant c. Procedure boundsStats(s, env, final) updates env for the
+list s of statements and procedure boundsLoop(t, env, final) for loop t; the checks of s 
+and t are removed only if final is True, when the intervals at the beginning of the loops 
+are known.
+'''
+
+def boundsExpr(x, env, final):
+    if type(x) == Check:
+        x.x = boundsExpr(x.x, env, final); lo, hi = interval(x.x, env)
+        if final and (lo > hi or x.array.lower <= lo and hi < x.array.lower + x.array.length):
+            return x.x
+        y, c = x.x, 0
+        if type(y) == Binary and y.op in (PLUS, MINUS) and type(y.y) == Const:
+            y, c = y.x, int(y.y.val) * (1 if y.op == PLUS else -1)
+        r = ranged(x.array.lower - c, x.array.lower + x.array.length - 1 - c)
+        if r != FULL: restrict(env, y, EQ, r)
+    elif type(x) == Binary and x.op in (AND, OR):
+        x.x = boundsExpr(x.x, env, final); e = dict(env); refine(e, x.x, x.op == AND)
+        x.y = boundsExpr(x.y, e, final)
+    else:
+        if type(x) in (Index, Select, Unary, Binary, Address): x.x = boundsExpr(x.x, env, final)
+        if type(x) in (Index, Binary): x.y = boundsExpr(x.y, env, final)
+    return x
+
+def setInterval(env, x, r):
+    if type(x) == Name and type(x.entry) == Var:
+        if x.tp == Int: env[x.entry] = r
+        else: env.pop(x.entry, None)
+
+def boundsStats(s, env, final):
+    for t in s:
+        if type(t) == Assign:
+            t.x = boundsExpr(t.x, env, final); t.y = boundsExpr(t.y, env, final)
+            setInterval(env, t.x, interval(t.y, env))
+        elif type(t) == Call:
+            t.args = [(boundsExpr(a, env, final), f) for a, f in t.args]; kill(env, [t])
+        elif type(t) == Read:
+            t.x = boundsExpr(t.x, env, final); setInterval(env, t.x, FULL)
+        elif type(t) == Write: t.x = boundsExpr(t.x, env, final)
+        elif type(t) == If:
+            t.x = boundsExpr(t.x, env, final); e = dict(env)
+            refine(e, t.x, True); boundsStats(t.then, e, final)
+            refine(env, t.x, False)
+            if t.els is not None: boundsStats(t.els, env, final)
+            join(env, [e])
+        elif type(t) == Case:
+            t.sel = boundsExpr(t.sel, env, final); es = []
+            for labels, u in t.arms:
+                e = dict(env); es.append(e)
+                vs = [int(l.val) for l in labels]; restrict(e, t.sel, EQ, (min(vs), max(vs)))
+                boundsStats(u, e, final)
+            if t.els is not None: boundsStats(t.els, env, final)
+            join(env, es)
+        elif type(t) in (While, For, ForIn): boundsLoop(t, env, final)
+
+def boundsLoop(t, env, final):
+    if type(t) == For:
+        t.z = boundsExpr(t.z, env, final); z = interval(t.z, env)
+    elif type(t) == ForIn:
+        t.elems = [boundsExpr(x, env, final) for x in t.elems]
+        es = [interval(x, env) for x in t.elems]; z = (min(es)[0], max(hi for lo, hi in es))
+    def enter(e, final):
+        if type(t) == While: t.x = boundsExpr(t.x, e, final); refine(e, t.x, True)
+        elif type(t) == For: restrict(e, t.x, LE if t.up else GE, z)
+        else: setInterval(e, t.x, z)
+    h = dict(env)
+    while True:
+        e = dict(h); enter(e, False); boundsStats(t.body, e, False)
+        if type(t) == For: # the counter is incremented or decremented at the end of the body
+            lo, hi = interval(t.x, e); c = 1 if t.up else -1
+            setInterval(e, t.x, ranged(lo + c, hi + c))
+        if not widen(h, e): break
+    e = dict(h); enter(e, final); boundsStats(t.body, e, final)
+    env.clear(); env.update(h)
+    if type(t) == While: boundsExpr(t.x, env, False); refine(env, t.x, False)
+    else: join(env, [e])
+
+def bounds(p):
+    for r in p.procs + [p]:
+        if any(type(y) == Check for t in statements(r.body) for x in exprs(t) for y in subexprs(x)):
+            boundsStats(r.body, {v: (0, 0) for v in r.vars + r.temps if v.tp == Int}, True)
+
+'''
+Pass promote turns global Int and Bool variables into local variables, which WebAssembly 
+engines keep in registers more readily. As these cannot be passed by reference, a global
+variable is only accessed by the routines that refer to it. A global variable that only the
+program refers to becomes a local variable of the program, as both are initialized to 0 and
+the program is executed once. A global variable that only one procedure refers to becomes a
+local variable of the procedure if the procedure is not recursive and assigns the variable
+before using it, such that no value is carried from one call to the next. Within loops, 
+the remaining global variables are kept in new local variables, which are assigned the
+global variable before the loop and, if the loop assigns it, assigned to the global variable
+after the loop, which is its only exit, unless the loop calls a procedure that refers to the
+global variable, directly or indirectly. 
+
+Procedure names(s) returns the variables that the list s of statements refers to and
+targets(s) those that s assigns, not including those assigned by calls; procedure
+substitute(s, m) replaces the variables of s by the expressions of dictionary m.
+'''
+
+def names(s):
+    return {x.entry for t in statements(s) for e in exprs(t) for x in subexprs(e) if type(x) == Name}
+
+def targets(s):
+    return {t.x.entry for t in statements(s)
+            if type(t) in (Assign, Read, For, ForIn) and type(t.x) == Name}
+
+def substitute(s, m):
+    for t in statements(s):
+        if type(t) == Assign: t.x, t.y = cloneExpr(t.x, m), cloneExpr(t.y, m)
+        elif type(t) == Call: t.args = [(cloneExpr(a, m), f) for a, f in t.args]
+        elif type(t) in (Read, Write, If, While): t.x = cloneExpr(t.x, m)
+        elif type(t) == For: t.x, t.z = cloneExpr(t.x, m), cloneExpr(t.z, m)
+        elif type(t) == ForIn: t.x, t.elems = cloneExpr(t.x, m), [cloneExpr(e, m) for e in t.elems]
+        elif type(t) == Case: t.sel = cloneExpr(t.sel, m)
+
+def promote(p):
+    procs, uses = {r.name: r for r in p.procs}, {r.name: names(r.body) for r in p.procs + [p]}
+    def reached(s): # names of the procedures that s calls, directly or indirectly
+        live, work = set(), [t.pr.name for t in statements(s) if type(t) == Call]
+        while work:
+            q = work.pop()
+            if q not in live:
+                live.add(q); work.extend(t.pr.name for t in statements(procs[q].body) if type(t) == Call)
+        return live
+    for v in [v for v in p.vars if v.tp in (Int, Bool)]:
+        rs = [r for r in p.procs + [p] if v in uses[r.name]]
+        if len(rs) == 1 and (rs[0] == p or rs[0].name not in reached(rs[0].body) and
+                             initialized(rs[0].body, v)):
+            p.vars.remove(v); v.lev = 1; rs[0].temps.append(v)
+    def cache(s, r):
+        n = []
+        for t in s:
+            if type(t) in (While, For, ForIn):
+                called = set().union(*(uses[q] for q in reached([t])))
+                m, post = {}, []
+                for v in p.vars:
+                    if v.tp in (Int, Bool) and v in names([t]) and v not in called:
+                        m[v] = Name(fresh(r, v.tp, 'cache', '_' + v.name))
+                        n.append(Assign(m[v], Name(v)))
+                        if v in targets([t]): post.append(Assign(Name(v), m[v]))
+                substitute([t], m); n.append(t); n.extend(post)
+            else: n.append(t)
+            for u in bodies(t): u[:] = cache(u, r)
+        return n
+    for r in p.procs + [p]: r.body = cache(r.body, r)
+
+PASSES = {'fold': fold, 'constprop': constprop, 'deadcode': deadcode, 'inline': inline,
+          'licm': licm, 'cse': cse, 'strength': strength, 'bounds': bounds, 'promote': promote}
+
+passes = ['inline', 'constprop', 'deadcode', 'promote', 'bounds', 'licm', 'strength', 'cse']
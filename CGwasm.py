@@ -0,0 +1,148 @@
+'''
+P0 Code Generator for WASM binaries
+
+This code generator produces a WebAssembly module in the binary format, so that no external
+tool like wat2wasm is needed before the module can be instantiated. The generation procedures
+are those of CGwat and are called in the same order by P0; only genProgExit differs: the
+generated code, which CGwat keeps in an intermediate representation, is encoded into a 
+bytearray and returned as bytes. The module consists of
+following sections:
+
+-type: the function types of the imported and declared functions
+-import: the functions write, writeln, read of P0lib, or flush, input in their place
+-function: the types of the declared functions, in the order of declaration
+-memory: the memory, in which records and arrays are allocated
+-global: the global Int, Bool variables, each initialized to 0
+-export: the memory, for buffered output or prefetched input
+-start: the function $program
+-code: the local variables and instructions of each declared function
+-data: the initial contents of memory, for lists of constants
+
+Errors in the code generator are reported by the generation procedures of CGwat; the 
+encoding supports all instructions of CGwat and reports no errors of its own.
+'''
+
+import nbimporter; nbimporter.options["only_defs"] = False
+from CGwat import I32, END, BLOCK, LOOP, IF, BR, BRIF, BRTABLE, CALL, LOCALGET, LOCALSET, \
+     LOCALTEE, GLOBALGET, GLOBALSET, I32CONST, I32LOAD, I32STORE, I32STORE8, MEMORYSIZE
+#the generation procedures of CGwat, which P0 calls through this module
+from CGwat import genBool, genInt, genRec, genArray, genProgStart, genGlobalVars, genProgEntry, \
+     genProcStart, genLocalVars, genProcEntry, genProcExit, genSelect, genIndex, genCheck, \
+     genVar, genConst, genUnaryOp, genBinaryOp, genRelation, genAssign, genActualPara, genCall, \
+     genRead, genWrite, genWriteln, genSeq, genThen, genIfThen, genElse, genIfElse, genWhile, \
+     genDo, genWhileDo, genForTo, genForNext, genForInit, genForArray, genForEnd, genCaseInit, \
+     genCaseArm, genCaseArmEnd, genCaseElse, genCaseEnd, procKey, procState, saveProc, reuseProc
+import CGwat
+
+'''
+Integers are encoded in the LEB128 format: unsigned integers are used for sizes, counts and
+indices, signed integers for the immediate operand of i32.const. Names are encoded by their
+length followed by their UTF-8 bytes, vectors by the number of elements followed by the elements.
+'''
+
+def uleb(n):
+    b = bytearray()
+    while True:
+        byte, n = n & 0x7f, n >> 7
+        if n == 0: b.append(byte); return b
+        b.append(byte | 0x80)
+
+def sleb(n):
+    b = bytearray()
+    while True:
+        byte, n = n & 0x7f, n >> 7
+        if (n == 0 and not byte & 0x40) or (n == -1 and byte & 0x40):
+            b.append(byte); return b
+        b.append(byte | 0x80)
+
+def name(s):
+    s = s.encode('utf-8')
+    return uleb(len(s)) + s
+
+def vec(elems):
+    b = uleb(len(elems))
+    for e in elems: b += e
+    return b
+
+def section(id, elems):
+    content = vec(elems)
+    return bytes([id]) + uleb(len(content)) + content
+
+'''
+Procedure genProgExit(x) completes the code of the program with CGwat.closeProgram() and 
+returns the module encoded by assemble().
+'''
+
+FUNCTYPE = 0x60; EMPTY = 0x40
+
+def genProgExit(x):
+    CGwat.closeProgram()
+    return assemble()
+
+'''
+Procedure assemble() encodes the module from the imported functions, the global variables,
+the declared functions and the data segments of CGwat. Function types are shared by all 
+functions with the same number of parameters and results. The code entry of each function, 
+returned by funcCode(f), is kept in codes until the next module is assembled, as CGwat.texts.
+'''
+
+codes = {}
+
+def funcCode(f):
+    body = bytearray()
+    for i in range(len(f.ops)): body += instruction(f, i)
+    body.append(END)
+    nlocals = len(f.names) - f.params
+    locdecl = vec([uleb(nlocals) + bytes([I32])] if nlocals else [])
+    return uleb(len(locdecl) + len(body)) + locdecl + body
+
+def assemble():
+    global codes
+    types, typeidx = [], {}
+    def functype(params, results):
+        t = bytes([FUNCTYPE]) + uleb(params) + bytes([I32] * params) + \
+            uleb(results) + bytes([I32] * results)
+        if t not in typeidx: typeidx[t] = len(types); types.append(t)
+        return typeidx[t]
+    imports = [name('P0lib') + name(n) + bytes([0x00]) + uleb(functype(params, results))
+               for n, params, results in CGwat.imports]
+    decls = [uleb(functype(f.params, 0)) for f in CGwat.funcs]
+    inits = [bytes([I32, 0x01, I32CONST, 0x00, END]) for g in CGwat.globs]
+    codes = {f: codes[f] if f in codes else funcCode(f) for f in CGwat.funcs}
+    code = [codes[f] for f in CGwat.funcs]
+    data = [bytes([0x00, I32CONST]) + sleb(adr) + bytes([END]) + uleb(len(d)) + d
+            for d, adr in CGwat.data.items()]
+    start = CGwat.funcidx['program']
+    module = bytearray(b'\0asm') + bytes([1, 0, 0, 0])
+    module += section(1, types)
+    module += section(2, imports)
+    module += section(3, decls)
+    module += section(5, [bytes([0x00]) + uleb(CGwat.memsize // 2**16 + 1)])
+    module += section(6, inits)
+    if CGwat.buffered or CGwat.prefetch: module += section(7, [name('memory') + bytes([0x02, 0x00])])
+    module += bytes([8]) + uleb(len(uleb(start))) + uleb(start)
+    module += section(10, code)
+    if data: module += section(11, data)
+    return bytes(module)
+
+'''
+Procedure instruction(f, i) encodes instruction i of function f. Instructions with a block 
+type are followed by 0x40 for no result or by 0x7f for a result of type i32; memory 
+instructions are followed by the alignment, which is 2**2, or 2**0 for i32.store8, and the 
+offset; memory.size is followed by the index of the memory.
+'''
+
+def instruction(f, i):
+    op, arg = f.ops[i], f.args[i]
+    b = bytearray([op])
+    if op in (BLOCK, LOOP, IF): b.append(I32 if arg == I32 else EMPTY)
+    elif op in (BR, BRIF, CALL, LOCALGET, LOCALSET, LOCALTEE, GLOBALGET, GLOBALSET):
+        b += uleb(arg)
+    elif op == BRTABLE:
+        b += uleb(len(f.tables[arg]) - 1)
+        for l in f.tables[arg]: b += uleb(l)
+    elif op == I32CONST: b += sleb(arg)
+    elif op in (I32LOAD, I32STORE): b += uleb(2) + uleb(arg)
+    elif op == I32STORE8: b += uleb(0) + uleb(arg)
+    elif op == MEMORYSIZE: b.append(0x00)
+    return b
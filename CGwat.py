@@ -12,7 +12,7 @@ in assembly language as a string in textual WebAssembly. The generation procedur
 -genBool, genInt, genRec, genArray
 -genProgStart, genGlobalVars, genProgEntry, genProgExit
 -genProcStart, genFormalParams, genLocalVars, genProcEntry, genProcExit
--genSelect, genIndex, genVar, genConst, genUnaryOp, genBinaryOp, genRelation
+-genSelect, genIndex, genCheck, genVar, genConst, genUnaryOp, genBinaryOp, genRelation
 -genAssign, genActualPara, genCall, genRead, genWrite, genWriteln
 -genSeq, genThen, genIfThen, genElse, genIfElse, genWhile, genDo, genWhileDo
 
@@ -24,25 +24,116 @@ which code is to be generated.
 import nbimporter; nbimporter.options["only_defs"] = False
 from SC import TIMES, DIV, MOD, AND, PLUS, MINUS, OR, EQ, NE, LT, GT, LE, \
      GE, NOT, mark, TILDE, AMP, BAR 
-from ST import indent, Var, Ref, Const, Type, Proc, StdProc, Int, Bool, Array, Record, topScope, find
+from ST import indent, Var, Ref, Const, Type, Proc, StdProc, Int, Bool, Array, Record
+from array import array
+
+'''
+The generated code is kept in an intermediate representation of WebAssembly instructions,
+from which the module is produced in textual form by genProgExit(x) or in binary form by
+CGwasm. Each instruction consists of an opcode, which is the opcode of the instruction in the
+binary format, and an integer operand:
+
+-for block, loop, if: I32 if the block has a result of type i32, 0 otherwise
+-for br, br_if: the label, i.e. the number of enclosing blocks to leave
+-for br_table: the index of the list of labels in the tables of the function
+-for call: the index of the function, where the imported functions come first
+-for local.get, local.set, local.tee: the index of the parameter or local variable
+-for global.get, global.set: the index of the global variable
+-for i32.load, i32.store, i32.store8: the offset that is added to the address
+-for memory.size: the index of the memory, which is always 0
+-for i32.const: the constant
+-for all other instructions: 0
+
+MNEMONICS maps the opcodes to the names of the instructions in the textual format.
+'''
+
+UNREACHABLE = 0x00; NOP = 0x01; BLOCK = 0x02; LOOP = 0x03; IF = 0x04; ELSE = 0x05
+END = 0x0b; BR = 0x0c; BRIF = 0x0d; BRTABLE = 0x0e; RETURN = 0x0f; CALL = 0x10
+DROP = 0x1a; SELECT = 0x1b; LOCALGET = 0x20; LOCALSET = 0x21; LOCALTEE = 0x22
+GLOBALGET = 0x23; GLOBALSET = 0x24; I32LOAD = 0x28; I32STORE = 0x36; I32STORE8 = 0x3a
+MEMORYSIZE = 0x3f; I32CONST = 0x41; I32EQZ = 0x45; I32EQ = 0x46; I32NE = 0x47; I32LTS = 0x48
+I32LTU = 0x49; I32GTS = 0x4a; I32GTU = 0x4b; I32LES = 0x4c; I32LEU = 0x4d; I32GES = 0x4e
+I32GEU = 0x4f; I32ADD = 0x6a; I32SUB = 0x6b; I32MUL = 0x6c; I32DIVS = 0x6d; I32DIVU = 0x6e
+I32REMS = 0x6f; I32REMU = 0x70; I32AND = 0x71; I32OR = 0x72; I32XOR = 0x73; I32SHL = 0x74
+I32SHRS = 0x75; I32SHRU = 0x76; I32 = 0x7f
+
+MNEMONICS = \
+    {UNREACHABLE: 'unreachable', NOP: 'nop', BLOCK: 'block', LOOP: 'loop', IF: 'if',
+    ELSE: 'else', END: 'end', BR: 'br', BRIF: 'br_if', BRTABLE: 'br_table',
+    RETURN: 'return', CALL: 'call', DROP: 'drop', SELECT: 'select',
+    LOCALGET: 'local.get', LOCALSET: 'local.set', LOCALTEE: 'local.tee',
+    GLOBALGET: 'global.get', GLOBALSET: 'global.set', I32LOAD: 'i32.load',
+    I32STORE: 'i32.store', I32STORE8: 'i32.store8', MEMORYSIZE: 'memory.size',
+    I32CONST: 'i32.const', I32EQZ: 'i32.eqz', I32EQ: 'i32.eq', I32NE: 'i32.ne',
+    I32LTS: 'i32.lt_s', I32LTU: 'i32.lt_u', I32GTS: 'i32.gt_s', I32GTU: 'i32.gt_u',
+    I32LES: 'i32.le_s', I32LEU: 'i32.le_u', I32GES: 'i32.ge_s', I32GEU: 'i32.ge_u',
+    I32ADD: 'i32.add', I32SUB: 'i32.sub', I32MUL: 'i32.mul', I32DIVS: 'i32.div_s',
+    I32DIVU: 'i32.div_u', I32REMS: 'i32.rem_s', I32REMU: 'i32.rem_u', I32AND: 'i32.and',
+    I32OR: 'i32.or', I32XOR: 'i32.xor', I32SHL: 'i32.shl', I32SHRS: 'i32.shr_s',
+    I32SHRU: 'i32.shr_u'}
+
+'''
+The code of a function is kept in an object of class Func with fields:
+
+-name, the name of the function
+-params, the number of parameters
+-names, the names of the parameters and local variables, in the order of their indices
+-index, a dictionary from the names of the parameters and local variables to their indices
+-ops, an array with the opcodes of the instructions
+-args, an array with the operands of the instructions
+-tables, a list with the lists of labels of br_table instructions
+
+The functions imported from P0lib are given as triples of the name, the number of parameters
+and the number of results: for output, those of WRITE, or of FLUSH if buffered is True, see
+genRuntime(), and for input, those of READ, or of INPUT if prefetch is True, see genRead(x).
+'''
+
+class Func:
+    __slots__ = ('name', 'params', 'names', 'index', 'ops', 'args', 'tables', 'pointers')
+    def __init__(self, name, params):
+        self.name, self.params, self.names, self.index = name, len(params), [], {}
+        self.ops, self.args, self.tables, self.pointers = array('B'), array('q'), [], set()
+        for p in params: self.declare(p)
+    def declare(self, name):
+        self.index[name] = len(self.names); self.names.append(name)
+    def __str__(self):
+        return 'func ' + self.name + ' (' + str(len(self.ops)) + ' instructions)'
+
+WRITE = [('write', 1, 0), ('writeln', 0, 0)]; FLUSH = [('flush', 2, 0)]
+READ = [('read', 0, 1)]; INPUT = [('input', 1, 1)]
+
+buffered, prefetch = False, False
+
+def emit(op, arg = 0):
+    code.ops.append(op); code.args.append(arg)
 
 '''
 Following variables determine the state of the code generator:
 
 -curlev is the current level of nesting of P0 procedures
 -memmax is the size of the memory, in which records and arrays are allocated
--asm is a list of strings with the WASM instruction in textual form
+-funcs is the list of the declared functions, of class Func, and code the current function
+-imports is the list of the imported functions
+-funcidx is a dictionary from the names of the imported and declared functions to their indices
+-globs is the list of the names of the global variables and globidx a dictionary from the 
+ names to their indices
+-temps is the number of temporary variables allocated by genTemp()
+-data is a dictionary from the contents of the data segments to their addresses in memory
+-fired is a dictionary from the names of the peephole rules to the number of times they were applied
 Procedure genProgStart() initializes these variables.
 '''
 
 def genProgStart():
-    global curlev, memsize, asm#, array_num
+    global curlev, memsize, funcs, code, imports, funcidx, globs, globidx, temps, data, fired#, array_num
     #array_num = 0
-    curlev, memsize = 0, 0
-    asm = ['(module',
-           '(import "P0lib" "write" (func $write (param i32)))',
-           '(import "P0lib" "writeln" (func $writeln))',
-           '(import "P0lib" "read" (func $read (result i32)))']
+    curlev, memsize, temps, data = 0, 0, 0, {}
+    fired = dict.fromkeys((n for n, op, r in RULES), 0)
+    funcs, code, globs, globidx = [], None, [], {}
+    imports = (FLUSH if buffered else WRITE) + (INPUT if prefetch else READ)
+    funcidx = {imports[i][0]: i for i in range(len(imports))}
+    if buffered: genRuntime()
+    if prefetch:
+        for g in ('in_pos', 'in_end'): globidx[g] = len(globs); globs.append(g)
 
 
 '''
@@ -100,7 +191,7 @@ def genGlobalVars(sc, start):
     for i in range(start, len(sc)):
         if type(sc[i]) == Var:
             if sc[i].tp in (Int, Bool):
-                asm.append('(global $' + sc[i].name + ' (mut i32) i32.const 0)')
+                globidx[sc[i].name] = len(globs); globs.append(sc[i].name)
             elif type(sc[i].tp) in (Array, Record):
                 sc[i].lev, sc[i].adr, memsize = -2, memsize, memsize + sc[i].tp.size
             else: mark('WASM: type?')
@@ -109,7 +200,7 @@ def genLocalVars(sc, start):
     for i in range(start, len(sc)):
         if type(sc[i]) == Var:
             if sc[i].tp in (Int, Bool):
-                asm.append('(local $' + sc[i].name + ' i32)')
+                code.declare(sc[i].name)
             elif type(sc[i].tp) in (Array, Record):
                 mark('WASM: no local arrays, records')
             else: mark('WASM: type?')
@@ -123,19 +214,56 @@ Procedure loadItem(x) generates code for loading x on the expression stack,
 
 def loadItem(x):
     if type(x) == Var:
-        if x.lev == 0: asm.append('global.get $' + x.name) # global Var
-        elif x.lev == curlev: asm.append('local.get $' + x.name) # local Var
+        if x.lev == 0: emit(GLOBALGET, globidx[x.name]) # global Var
+        elif x.lev == curlev: emit(LOCALGET, code.index[x.name]) # local Var
         elif x.lev == -2: # memory Var
-            asm.append('i32.const ' + str(x.adr))
-            asm.append('i32.load')
+            emit(I32CONST, x.adr)
+            emit(I32LOAD)
         elif x.lev != -1: mark('WASM: var level!') # already on stack if lev == -1
     elif type(x) == Ref:
-        if x.lev == -1: asm.append('i32.load')
+        if x.lev == -1: emit(I32LOAD)
         elif x.lev == curlev:
-            asm.append('local.get $' + x.name)
-            asm.append('i32.load')
+            emit(LOCALGET, code.index[x.name])
+            emit(I32LOAD)
         else: mark('WASM: ref level!')
-    elif type(x) == Const: asm.append('i32.const ' + str(x.val))
+    elif type(x) == Const: emit(I32CONST, x.val)
+
+'''
+The code of an operand is generated when P0 parses it only if the operand is an operation
+or an element of an array at a computed address, otherwise only when it is loaded. Procedure 
+loadOperands(x, y, swappable) loads operands x and y of a binary operation, where the code 
+of y has been generated after that of x. If y is on the expression stack, but x is not, or
+x is a Ref on the stack that still has to be loaded, y is loaded first: if the operation is
+swappable, x is then loaded on top of y and True is returned, otherwise y is kept in a
+temporary variable while x is loaded. Procedure onStack(x) tells whether code for x has 
+been generated.
+'''
+
+def onStack(x):
+    return type(x) != Const and x.lev == -1
+
+def loadOperands(x, y, swappable):
+    if not onStack(y) or type(x) == Var and x.lev == -1:
+        loadItem(x); loadItem(y)
+        return False
+    loadItem(y)
+    if swappable and not onStack(x):
+        loadItem(x)
+        return True
+    t = genTemp(); emit(LOCALSET, code.index[t.name])
+    loadItem(x); emit(LOCALGET, code.index[t.name])
+    return False
+
+'''
+Procedure loadAddress(x) generates code for loading the address of x, assuming x is memory
+Var, local Ref or stack Ref, and returns x as stack Ref.
+'''
+
+def loadAddress(x):
+    if x.lev == -2: emit(I32CONST, x.adr)
+    elif x.lev == curlev: emit(LOCALGET, code.index[x.name])
+    y = Ref(x.tp); y.lev = -1
+    return y
 
 def genVar(x):
     # x is Var, Ref
@@ -165,27 +293,31 @@ Procedure genUnaryOp(op, x) generates code for op x if op is MINUS, NOT and x is
 '''    
 
 def genUnaryOp(op, x):
+    if op == MINUS and not onStack(x):
+        emit(I32CONST, 0) # -x is 0 - x, unless x is already on the stack
+        loadItem(x)
+        emit(I32SUB)
+        x = Var(Int); x.lev = -1
+        return x
     loadItem(x)
     if op == MINUS:
-        asm.append('i32.const -1')
-        asm.append('i32.mul')
+        emit(I32CONST, -1)
+        emit(I32MUL)
         x = Var(Int); x.lev = -1
     elif op == NOT:
-        asm.append('i32.eqz')
+        emit(I32EQZ)
         x = Var(Bool); x.lev = -1
     elif op == AND:
-        asm.append('if (result i32)')
+        emit(IF, I32)
         x = Var(Bool); x.lev = -1
     elif op == OR:
-        asm.append('if (result i32)')
-        asm.append('i32.const 1')
-        asm.append('else')
+        emit(IF, I32)
+        emit(I32CONST, 1)
+        emit(ELSE)
         x = Var(Bool); x.lev = -1
     elif op == TILDE:
-        asm.append('i32.const -1')
-        asm.append('i32.mul')
-        asm.append('i32.const -1')
-        asm.append('i32.add')
+        emit(I32CONST, -1)
+        emit(I32XOR)
         x = Var(Int); x.lev = -1
     else: mark('WASM: unary operator?')
     return x
@@ -198,40 +330,43 @@ has already been generated; code for y and the remainder of the if instruction i
 
 def genBinaryOp(op, x, y):
     if op in (PLUS, MINUS, TIMES, DIV, MOD, AMP, BAR):
-        loadItem(x); loadItem(y)
-        asm.append('i32.add' if op == PLUS else \
-                   'i32.sub' if op == MINUS else \
-                   'i32.mul' if op == TIMES else \
-                   'i32.div_s' if op == DIV else \
-                   'i32.rem_s' if op == MOD else \
-                   'i32.and' if op == AMP else \
-                   'i32.or' if op == BAR else'?')
+        loadOperands(x, y, op in (PLUS, TIMES, AMP, BAR))
+        emit(I32ADD if op == PLUS else \
+             I32SUB if op == MINUS else \
+             I32MUL if op == TIMES else \
+             I32DIVS if op == DIV else \
+             I32REMS if op == MOD else \
+             I32AND if op == AMP else \
+             I32OR if op == BAR else UNREACHABLE)
         x = Var(Int); x.lev = -1
     elif op == AND:
         loadItem(y) # x is already on the stack
-        asm.append('else')
-        asm.append('i32.const 0')
-        asm.append('end')
+        emit(ELSE)
+        emit(I32CONST, 0)
+        emit(END)
         x = Var(Bool); x.lev = -1
     elif op == OR:
         loadItem(y) # x is already on the stack
-        asm.append('end')
+        emit(END)
         x = Var(Bool); x.lev = -1
     else: assert False
     return x
 
 '''
-Procedure genRelation(op, x, y) generates code for x op y if op is EQ, NE, LT, LE, GT, GE.
+Procedure genRelation(op, x, y) generates code for x op y if op is EQ, NE, LT, LE, GT, GE;
+if the operands are swapped, y MIRROR[op] x is generated instead.
 '''
 
+MIRROR = {EQ: EQ, NE: NE, LT: GT, GT: LT, LE: GE, GE: LE}
+
 def genRelation(op, x, y):
-    loadItem(x); loadItem(y)
-    asm.append('i32.eq' if op == EQ else \
-               'i32.ne' if op == NE else \
-               'i32.lt_s' if op ==  LT else \
-               'i32.gt_s' if op == GT else \
-               'i32.le_s' if op == LE else \
-               'i32.ge_s' if op == GE else '?')
+    if loadOperands(x, y, True): op = MIRROR[op]
+    emit(I32EQ if op == EQ else \
+         I32NE if op == NE else \
+         I32LTS if op ==  LT else \
+         I32GTS if op == GT else \
+         I32LES if op == LE else \
+         I32GES if op == GE else UNREACHABLE)
     x = Var(Bool); x.lev = -1
     return x
 
@@ -247,9 +382,9 @@ def genSelect(x, f):
     # and f is Field
     if type(x) == Var: x.adr += f.offset
     elif type(x) == Ref:
-        if x.lev > 0: asm.append('local.get $' + x.name)
-        asm.append('i32.const ' + str(f.offset))
-        asm.append('i32.add')
+        if x.lev > 0: emit(LOCALGET, code.index[x.name])
+        emit(I32CONST, f.offset)
+        emit(I32ADD)
         x.lev = -1
     x.tp = f.tp
     return x
@@ -257,7 +392,9 @@ def genSelect(x, f):
 '''
 Procedure genIndex(x, y) generates code for x[y], assuming x is Var or Ref, x.tp is 
 Array, and y.tp is Int. If y is Const, only x.adr is updated and no code is generated, 
-otherwise code for array index calculation is generated.
+otherwise code for array index calculation is generated. The lower bound of the array is
+not subtracted from y, but y times the size of the elements is added to the address that
+element 0 would have, which is a constant for Var and an offset for Ref.
 '''    
 
 def genIndex(x, y):
@@ -269,147 +406,469 @@ def genIndex(x, y):
             x.tp = x.tp.base
         else: # y is global Var, local Var, stack Var
             loadItem(y) # y on stack
-            if x.tp.lower != 0:
-                asm.append('i32.const ' + str(x.tp.lower))
-                asm.append('i32.sub')
-            asm.append('i32.const ' + str(x.tp.base.size))
-            asm.append('i32.mul')
-            asm.append('i32.const ' + str(x.adr))
-            asm.append('i32.add')
+            emit(I32CONST, x.tp.base.size)
+            emit(I32MUL)
+            emit(I32CONST, x.adr - x.tp.lower * x.tp.base.size) # lower bound folded into x.adr
+            emit(I32ADD)
             x = Ref(x.tp.base); x.lev = -1
     else: # x is local Ref, stack Ref; y is Const, global Var, local Var, stack Var
-        if x.lev == curlev: loadItem(x); x.lev = -1;
         if type(y) == Const:
-            asm.append('i32.const ' + str((y.val - x.tp.lower) * x.tp.base.size))
-            asm.append('i32.add')
-        else:
+            if x.lev == curlev: emit(LOCALGET, code.index[x.name])
+            emit(I32CONST, (y.val - x.tp.lower) * x.tp.base.size)
+            emit(I32ADD)
+        else: # the address of x is added after the index, as code for y may be on the stack
             loadItem(y) # y on stack
-            asm.append('i32.const ' + str(x.tp.lower))
-            asm.append('i32.sub')
-            asm.append('i32.const ' + str(x.tp.base.size))
-            asm.append('i32.mul')
-            asm.append('i32.add')
-        x.tp = x.tp.base
+            emit(I32CONST, x.tp.base.size)
+            emit(I32MUL)
+            if x.lev == curlev: emit(LOCALGET, code.index[x.name])
+            emit(I32ADD)
+            if x.tp.lower != 0:
+                emit(I32CONST, - x.tp.lower * x.tp.base.size) # lower bound as offset
+                emit(I32ADD)
+        x.tp, x.lev = x.tp.base, -1
     return x
 
+'''
+Procedure genCheck(x, y) generates code that traps if y is not within the bounds of array
+x, assuming x.tp is Array and y.tp is Int; P0 calls it before genIndex(x, y) for an index y
+that is not Const if checks are enabled. As y - x.tp.lower is compared to x.tp.length
+without sign, a single comparison covers both bounds:
+
+    y - lower
+    length
+    i32.ge_u
+    if
+      unreachable
+    end
+
+Unless y is a global or local Var, which can be loaded again, the value of y is kept in a 
+temporary variable, which is returned in place of y.
+'''
+
+def genCheck(x, y):
+    loadItem(y)
+    if type(y) != Var or y.lev not in (0, curlev):
+        y = genTemp(); emit(LOCALTEE, code.index[y.name])
+    if x.tp.lower != 0:
+        emit(I32CONST, x.tp.lower)
+        emit(I32SUB)
+    emit(I32CONST, x.tp.length)
+    emit(I32GEU)
+    emit(IF)
+    emit(UNREACHABLE)
+    emit(END)
+    return y
+
 '''
 Procedure genAssign(x, y) generates code for x := y, provided x is Var, Ref and y is Var, Ref.
+If the address of x is not on the stack but code for y is, y is kept in a temporary variable
+while the address is loaded.
 '''
 
 def genAssign(x, y):
-    if type(x) == Var:
-        if x.lev == -2: asm.append('i32.const ' + str(x.adr))
+    if type(x) == Var and x.lev in (0, curlev):
         loadItem(y)
-        if x.lev == 0: asm.append('global.set $' + x.name)
-        elif x.lev == curlev: asm.append('local.set $' + x.name)
-        elif x.lev == -2: asm.append('i32.store')
-        else: mark('WASM: level!')
-    elif type(x) == Ref:
-        if x.lev == curlev: asm.append('local.get $' + x.name)
+        if x.lev == 0: emit(GLOBALSET, globidx[x.name])
+        else: emit(LOCALSET, code.index[x.name])
+    elif type(x) == Var and x.lev == -2 or type(x) == Ref and x.lev == curlev:
+        t = None
+        if onStack(y):
+            loadItem(y); t = genTemp(); emit(LOCALSET, code.index[t.name])
+        if x.lev == -2: emit(I32CONST, x.adr)
+        else: emit(LOCALGET, code.index[x.name])
+        loadItem(t or y)
+        emit(I32STORE)
+    elif type(x) == Ref and x.lev == -1:
         loadItem(y)
-        asm.append('i32.store')
-    else: assert False
+        emit(I32STORE)
+    else: mark('WASM: level!')
+
+'''
+Local variables are declared at the beginning of a function in WebAssembly, but for and case 
+statements declare further local variables in the body of a function. Therefore, procedure 
+openFunc(name, params) makes a new function the current one, to which genLocalVars adds the 
+declarations of local variables at any time; procedure closeFunc() completes the function.
+'''
+
+def openFunc(name, params):
+    global code
+    funcidx[name] = len(imports) + len(funcs)
+    code = Func(name, params); funcs.append(code)
+
+def closeFunc():
+    if optimize: peephole(code)
+
+'''
+Procedure peephole(f) improves the instructions of function f in place, before the function 
+is closed. Each rule of RULES is a triple of a name, the opcode of the first instruction to 
+which the rule applies, and a procedure rule(ops, args, i) that returns None if it does not 
+apply at index i of the opcodes ops and operands args, and otherwise the pair of the number 
+of instructions from i on to be replaced and the list of replacing instructions as pairs of 
+opcode and operand. The rules are tried at each index until none applies. As replacements 
+may enable further replacements before index i, the search resumes at most three 
+instructions earlier. Branches in WebAssembly only target the start or end of blocks, so 
+rules that do not look past block instructions can be applied regardless of the control 
+flow. Multiplications by powers of 2 are replaced by shifts by shiftConst, which comes last,
+so that the other rules can combine them with constants first. WebAssembly adds the offset 
+of a load or store to the address without wrapping around and traps if the sum is out of 
+memory, so a constant is only moved to the offset if the address it is added to cannot be 
+negative: that is the value of a reference parameter, which always points to a variable, as 
+held in pointers for the function f being improved; addresses computed from indices are not
+folded, as an index that is out of bounds may be compensated by a constant that is added.
+The number of times each rule was applied is counted in fired. If optimize is False, the instructions are not changed.
+'''
+
+optimize = True
+
+def i32(n):
+    return (n + 2**31) % 2**32 - 2**31
+
+FOLD = {I32ADD: lambda a, b: a + b, I32SUB: lambda a, b: a - b,
+        I32MUL: lambda a, b: a * b, I32AND: lambda a, b: a & b,
+        I32OR: lambda a, b: a | b, I32XOR: lambda a, b: a ^ b, I32SHL: lambda a, b: a << (b & 31)}
+
+PUSH = (I32CONST, LOCALGET, GLOBALGET)
+
+def foldConst(ops, args, i): # i32.const a, i32.const b, op -> i32.const a op b
+    if i + 2 < len(ops) and ops[i] == ops[i + 1] == I32CONST and ops[i + 2] in FOLD:
+        return 3, [(I32CONST, i32(FOLD[ops[i + 2]](args[i], args[i + 1])))]
+
+def identity(ops, args, i): # i32.const 0, i32.add -> , i32.const 1, i32.mul -> 
+    if i + 1 < len(ops) and ops[i] == I32CONST:
+        if args[i] == 0 and ops[i + 1] in (I32ADD, I32SUB, I32OR, I32XOR) or \
+           args[i] == 1 and ops[i + 1] in (I32MUL, I32DIVS): return 2, []
+
+def subConst(ops, args, i): # i32.const a, i32.sub -> i32.const -a, i32.add
+    if i + 1 < len(ops) and ops[i] == I32CONST and ops[i + 1] == I32SUB and args[i] != -2**31:
+        return 2, [(I32CONST, -args[i]), (I32ADD, 0)]
+
+def addConst(ops, args, i): # i32.const a, i32.add, i32.const b, i32.add -> i32.const a + b, i32.add
+    if i + 3 < len(ops) and ops[i] == ops[i + 2] == I32CONST and ops[i + 1] == ops[i + 3] == I32ADD:
+        return 4, [(I32CONST, i32(args[i] + args[i + 2])), (I32ADD, 0)]
+
+def scaleConst(ops, args, i): # i32.const a, i32.add, i32.const b, i32.mul -> i32.const b, i32.mul, i32.const a * b, i32.add
+    if i + 3 < len(ops) and ops[i] == ops[i + 2] == I32CONST and ops[i + 1] == I32ADD and \
+       ops[i + 3] == I32MUL:
+        return 4, [(I32CONST, args[i + 2]), (I32MUL, 0), (I32CONST, i32(args[i] * args[i + 2])), (I32ADD, 0)]
+
+def mulConst(ops, args, i): # i32.const a, i32.mul, i32.const b, i32.mul -> i32.const a * b, i32.mul
+    if i + 3 < len(ops) and ops[i] == ops[i + 2] == I32CONST and ops[i + 1] == ops[i + 3] == I32MUL:
+        return 4, [(I32CONST, i32(args[i] * args[i + 2])), (I32MUL, 0)]
+
+def shiftConst(ops, args, i): # i32.const 2**n, i32.mul -> i32.const n, i32.shl
+    if i + 1 < len(ops) and ops[i] == I32CONST and ops[i + 1] == I32MUL and args[i] > 1 and \
+       args[i] & (args[i] - 1) == 0:
+        return 2, [(I32CONST, args[i].bit_length() - 1), (I32SHL, 0)]
+
+def tee(ops, args, i): # local.set $x, local.get $x -> local.tee $x
+    if i + 1 < len(ops) and ops[i] == LOCALSET and ops[i + 1] == LOCALGET and args[i] == args[i + 1]:
+        return 2, [(LOCALTEE, args[i])]
+
+def pointer(ops, args, i): # local.get $p at i - 1 for a reference parameter p
+    return i > 0 and ops[i - 1] == LOCALGET and args[i - 1] in pointers
+
+def loadOffset(ops, args, i): # local.get $p, i32.const a, i32.add, i32.load -> local.get $p, i32.load offset=a
+    if i + 2 < len(ops) and ops[i] == I32CONST and ops[i + 1] == I32ADD and ops[i + 2] == I32LOAD \
+       and pointer(ops, args, i) and args[i] >= 0 and args[i] + args[i + 2] < 2**31:
+        return 3, [(I32LOAD, args[i] + args[i + 2])]
+
+def storeOffset(ops, args, i): # local.get $p, i32.const a, i32.add, push, i32.store -> local.get $p, push, i32.store offset=a
+    if i + 3 < len(ops) and ops[i] == I32CONST and ops[i + 1] == I32ADD and ops[i + 2] in PUSH \
+       and ops[i + 3] == I32STORE and pointer(ops, args, i) and args[i] >= 0 and \
+       args[i] + args[i + 3] < 2**31:
+        return 4, [(ops[i + 2], args[i + 2]), (I32STORE, args[i] + args[i + 3])]
+
+RULES = [('foldConst', I32CONST, foldConst), ('identity', I32CONST, identity),
+         ('subConst', I32CONST, subConst), ('addConst', I32CONST, addConst),
+         ('scaleConst', I32CONST, scaleConst), ('mulConst', I32CONST, mulConst),
+         ('tee', LOCALSET, tee), ('loadOffset', I32CONST, loadOffset),
+         ('storeOffset', I32CONST, storeOffset), ('shiftConst', I32CONST, shiftConst)]
+
+def peephole(f):
+    global pointers
+    pointers, first = f.pointers, {}
+    for n, op, rule in RULES: first.setdefault(op, []).append((n, rule))
+    ops, args, i = f.ops, f.args, 0
+    while i < len(ops):
+        for n, rule in first.get(ops[i], ()):
+            r = rule(ops, args, i)
+            if r != None:
+                ops[i:i + r[0]] = array('B', [op for op, arg in r[1]])
+                args[i:i + r[0]] = array('q', [arg for op, arg in r[1]])
+                fired[n] += 1; i = max(i - 3, 0)
+                break
+        else: i += 1
 
 '''
 The rest of the code
 '''        
 
 
+'''
+The body of the program is generated at level 1, like the body of a procedure, such that 
+the local variables of $program are accessed like those of a procedure. Procedure 
+closeProgram() completes $program, which flushes the output first if buffered is True. If 
+prefetch is True, $program starts by fetching the input, see genRead(x).
+'''
+
 def genProgEntry(ident):
-    asm.append('(func $program')
+    global curlev
+    curlev = 1
+    openFunc('program', [])
+    if prefetch: # in_pos := memory.size * 2**16; in_end := in_pos + input(in_pos) * 4
+        emit(MEMORYSIZE); emit(I32CONST, 16); emit(I32SHL); emit(GLOBALSET, globidx['in_pos'])
+        emit(GLOBALGET, globidx['in_pos']); emit(GLOBALGET, globidx['in_pos'])
+        emit(CALL, funcidx['input']); emit(I32CONST, 2); emit(I32SHL); emit(I32ADD)
+        emit(GLOBALSET, globidx['in_end'])
+
+def closeProgram():
+    if buffered:
+        emit(GLOBALGET, globidx['out_len']); emit(IF); genFlush(); emit(END)
+    closeFunc()
 
 def genProgExit(x):
-    asm.append(')\n(memory ' + str(memsize // 2** 16 + 1) + ')\n(start $program)\n)')
-    return '\n'.join(l for l in asm)
+    closeProgram()
+    return genModule()
+
+'''
+Procedure genModule() returns the module in textual form, with one declaration or instruction 
+per line; procedure funcText(f) returns function f and procedure instruction(f, i) returns 
+instruction i of function f in textual form. The text of each function is kept in texts until 
+the next module is generated, so that the text of functions reused by incremental compilation 
+is not produced again.
+'''
+
+texts = {}
+
+def funcText(f):
+    wat = [' '.join(['(func $' + f.name] + ['(param $' + p + ' i32)' for p in f.names[:f.params]])]
+    for l in f.names[f.params:]: wat.append('(local $' + l + ' i32)')
+    for i in range(len(f.ops)): wat.append(instruction(f, i))
+    wat.append(')')
+    return '\n'.join(wat)
+
+def genModule():
+    global texts
+    texts = {f: texts[f] if f in texts else funcText(f) for f in funcs}
+    wat = ['(module']
+    for n, params, results in imports:
+        wat.append('(import "P0lib" "' + n + '" (func $' + n + ' (param i32)' * params +
+                   ' (result i32)' * results + '))')
+    for g in globs: wat.append('(global $' + g + ' (mut i32) i32.const 0)')
+    for f in funcs: wat.append(texts[f])
+    for d, adr in data.items():
+        wat.append('(data (i32.const ' + str(adr) + ') "' + ''.join('\\%02x' % b for b in d) + '")')
+    wat.append('(memory' + ' (export "memory")' * (buffered or prefetch) + ' ' + 
+               str(memsize // 2** 16 + 1) + ')\n(start $program)\n)')
+    return '\n'.join(wat)
+
+def instruction(f, i):
+    op, arg = f.ops[i], f.args[i]
+    if op in (BLOCK, LOOP, IF): return MNEMONICS[op] + ' (result i32)' * (arg == I32)
+    elif op in (BR, BRIF, I32CONST): return MNEMONICS[op] + ' ' + str(arg)
+    elif op == BRTABLE: return 'br_table ' + ' '.join(str(l) for l in f.tables[arg])
+    elif op == CALL: return 'call $' + (imports[arg][0] if arg < len(imports) else funcs[arg - len(imports)].name)
+    elif op in (LOCALGET, LOCALSET, LOCALTEE): return MNEMONICS[op] + ' $' + f.names[arg]
+    elif op in (GLOBALGET, GLOBALSET): return MNEMONICS[op] + ' $' + globs[arg]
+    elif op in (I32LOAD, I32STORE, I32STORE8): return MNEMONICS[op] + (' offset=' + str(arg)) * (arg != 0)
+    else: return MNEMONICS[op]
 
 def genProcStart(ident, fp):
     global curlev
     if curlev > 0: mark('WASM: no nested procedures')
+    if ident in funcidx: mark('WASM: ' + ident + ' is reserved')
     curlev = curlev + 1
-    asm.append('(func $' + ident + ' ' + ' '.join('(param $' + e.name + ' i32)' for e in fp) + '')
+    openFunc(ident, [e.name for e in fp])
+    code.pointers = {code.index[p.name] for p in fp if type(p) == Ref}
     for p in fp:
         if p.tp in (Int, Bool) and type(p) == Ref:
             mark('WASM: only array and record reference parameters')
         elif type(p.tp) in (Array, Record) and type(p) == Var:
             mark('WASM: no structured value parameters')
 
+'''
+For incremental compilation, see P0, the function of a procedure can be taken from an earlier 
+compilation instead of generating its body once more:
+
+-procKey(idents) returns the state of the generator on which the code for a procedure body 
+ with identifiers idents depends, besides the symbol table: the imports and options, and the 
+ indices of the functions and global variables named by idents
+-procState() returns the state that generating a procedure body may change
+-saveProc(state) returns the function of the procedure just completed, together with the
+ number of temporary variables before and after and the number of peephole rules applied, 
+ where state was returned by procState() before the body was generated; it returns None if
+ the body declared global variables or data segments, as then it cannot be reused
+-reuseProc(saved) completes the procedure just started by genProcStart with the function 
+ saved by saveProc and returns True, unless the body has temporary variables that would be 
+ named differently now, in which case it returns False and the body has to be generated
+'''
+
+def procKey(idents):
+    return tuple(imports), buffered, prefetch, optimize, curlev, \
+           tuple((funcidx.get(n), globidx.get(n)) for n in idents)
+
+def procState():
+    return len(globs), memsize, len(data), temps, dict(fired)
+
+def saveProc(state):
+    if state[:3] != (len(globs), memsize, len(data)): return None
+    return code, state[3], temps, {n: fired[n] - state[4][n] for n in fired}
+
+def reuseProc(saved):
+    global code, curlev, temps
+    f, start, end, applied = saved
+    if start != end and start != temps: return False
+    funcs[-1] = code = f; curlev, temps = curlev - 1, temps + end - start
+    for n in applied: fired[n] += applied[n]
+    return True
+
 def genProcEntry(ident, parsize, localsize):
     pass
 
 def genProcExit(x, parsize, localsize):
     global curlev
     curlev = curlev - 1
-    asm.append(')')
+    closeFunc()
 
 def genActualPara(ap, fp, n):
-    if type(fp) == Ref:  #  reference parameter, assume ap is Var
-        if ap.lev == -2: asm.append('i32.const ' + str(ap.adr))
-        # else ap.lev == -1, on stack already
+    if type(fp) == Ref: loadAddress(ap) #  reference parameter, assume ap is Var, Ref
     elif type(ap) in (Var, Ref, Const): loadItem(ap)
     else: mark('unsupported parameter type')
 
 def genCall(pr, ap):
-    asm.append('call $' + pr.name)
+    emit(CALL, funcidx[pr.name])
     
+'''
+If prefetch is True, the integers to be read are not requested from the host one by one, but
+fetched at the start of $program by calling the imported input(ptr) once: the host stores all 
+integers of the input in 4 bytes each from address ptr on, growing the memory as needed, and
+returns their number. As ptr is the size of the memory at the start, the integers do not 
+overlap with variables and data. The next integer to be read is at in_pos and the input ends 
+at in_end, where in_pos and in_end are global variables. Procedure genRead(x) then loads the 
+integer at in_pos and advances in_pos, after trapping if the input is exhausted.
+'''
+
 def genRead(x):
-    asm.append('call $read')
+    if prefetch: # if in_pos >= in_end then unreachable; mem[in_pos]; in_pos := in_pos + 4
+        emit(GLOBALGET, globidx['in_pos']); emit(GLOBALGET, globidx['in_end']); emit(I32GEU)
+        emit(IF); emit(UNREACHABLE); emit(END)
+        emit(GLOBALGET, globidx['in_pos']); emit(I32LOAD)
+        emit(GLOBALGET, globidx['in_pos']); emit(I32CONST, 4); emit(I32ADD)
+        emit(GLOBALSET, globidx['in_pos'])
+    else: emit(CALL, funcidx['read'])
     #after calling read, store into the variable
-    if type(x) == Var:
-        if x.lev == 0: asm.append('global.set $' + x.name) # global Var
-        elif x.lev == curlev: asm.append('local.set $' + x.name) # local Var
-        elif x.lev == -2: # memory Var
-            asm.append('i32.const ' + str(x.adr))
-            asm.append('i32.store')
-        elif x.lev != -1: mark('WASM: var level!') # already on stack if lev == -1
     y = Var(Int); y.lev = -1
+    genAssign(x, y)
 
 def genWrite(x):
     loadItem(x)
-    asm.append('call $write')
+    emit(CALL, funcidx['write'])
 
 def genWriteln():
-    asm.append('call $writeln')
+    emit(CALL, funcidx['writeln'])
+
+'''
+If buffered is True, the output is not passed to the host by a call for each integer and 
+newline, but collected in a buffer of BUFSIZE bytes at address 0 of memory, of which the first
+out_len bytes are used, where out_len is a global variable; the name cannot clash with the 
+names of P0 variables. Procedure genRuntime() declares out_len and the functions $write and 
+$writeln, which take the place of the imported ones. Integers are formatted in decimal, with 
+a leading - if negative, and newlines as the byte 10, as by the P0lib of the JavaScript 
+runtime. When the buffer cannot hold the next integer or newline, and at the end of 
+$program, the output is passed to the host by calling the imported flush(ptr, len); the 
+memory is exported as "memory", from which the host takes the len bytes at address ptr. If 
+the program traps, the output in the buffer is lost.
+
+$write(x) first stores the sign and negates x, after which x is treated as unsigned, as 
+-2**31 has no positive counterpart. Then position p is advanced by the number of digits of x, 
+counted with n, and the digits are stored from p backwards, as x rem 10 yields the last one.
+'''
+
+BUFSIZE = 4096
+
+def genFlush(): # flush(0, out_len); out_len := 0
+    emit(I32CONST, 0); emit(GLOBALGET, globidx['out_len']); emit(CALL, funcidx['flush'])
+    emit(I32CONST, 0); emit(GLOBALSET, globidx['out_len'])
+
+def genReserve(n): # flush unless n bytes are free
+    emit(GLOBALGET, globidx['out_len']); emit(I32CONST, BUFSIZE - n); emit(I32GTS)
+    emit(IF); genFlush(); emit(END)
+
+def genRuntime():
+    global code, memsize
+    memsize = BUFSIZE
+    globidx['out_len'] = len(globs); globs.append('out_len')
+    openFunc('write', ['x']); x, p, n = 0, 1, 2
+    code.declare('p'); code.declare('n'); genReserve(11)
+    emit(GLOBALGET, globidx['out_len']); emit(LOCALSET, p) # p := out_len
+    emit(LOCALGET, x); emit(I32CONST, 0); emit(I32LTS); emit(IF) # if x < 0 then
+    emit(LOCALGET, p); emit(I32CONST, ord('-')); emit(I32STORE8) # mem[p] := '-'
+    emit(LOCALGET, p); emit(I32CONST, 1); emit(I32ADD); emit(LOCALSET, p) # p := p + 1
+    emit(I32CONST, 0); emit(LOCALGET, x); emit(I32SUB); emit(LOCALSET, x) # x := -x
+    emit(END); emit(LOCALGET, x); emit(LOCALSET, n) # n := x
+    emit(LOOP) # repeat
+    emit(LOCALGET, p); emit(I32CONST, 1); emit(I32ADD); emit(LOCALSET, p) # p := p + 1
+    emit(LOCALGET, n); emit(I32CONST, 10); emit(I32DIVU); emit(LOCALTEE, n) # n := n div 10
+    emit(BRIF, 0); emit(END) # until n = 0
+    emit(LOCALGET, p); emit(GLOBALSET, globidx['out_len']) # out_len := p
+    emit(LOOP) # repeat
+    emit(LOCALGET, p); emit(I32CONST, 1); emit(I32SUB); emit(LOCALTEE, p) # p := p - 1
+    emit(LOCALGET, x); emit(I32CONST, 10); emit(I32REMU); emit(I32CONST, ord('0'))
+    emit(I32ADD); emit(I32STORE8) # mem[p] := '0' + x rem 10
+    emit(LOCALGET, x); emit(I32CONST, 10); emit(I32DIVU); emit(LOCALTEE, x) # x := x div 10
+    emit(BRIF, 0); emit(END) # until x = 0
+    closeFunc()
+    openFunc('writeln', []); genReserve(1)
+    emit(GLOBALGET, globidx['out_len']); emit(I32CONST, 10); emit(I32STORE8) # mem[out_len] := 10
+    emit(GLOBALGET, globidx['out_len']); emit(I32CONST, 1); emit(I32ADD)
+    emit(GLOBALSET, globidx['out_len']) # out_len := out_len + 1
+    closeFunc()
+    code = None
 
 def genSeq(x, y):
     pass
 
 def genThen(x):
     loadItem(x)
-    asm.append('if')
+    emit(IF)
     return x
 
 def genIfThen(x, y):
-    asm.append('end')
+    emit(END)
 
 def genElse(x, y):
-    asm.append('else')
+    emit(ELSE)
 
 def genIfElse(x, y, z):
-    asm.append('end')
+    emit(END)
 
 def genWhile():
-    asm.append('loop')
+    emit(LOOP)
     
 def genDo(x):
     loadItem(x)
-    asm.append('if')
+    emit(IF)
     return x
 
 def genWhileDo(t, x, y):
-    asm.append('br 1')
-    asm.append('end')
-    asm.append('end')
+    emit(BR, 1)
+    emit(END)
+    emit(END)
 
 #genForArray for generating array for global variable,
 #initializing array with values from the input array
-def genForArray(array_name, inputList):
-    #generate global variables (array) starting from 
-    #len(topScope)-1 because array is the only one added
-    genGlobalVars(topScope(), len(topScope())-1)
-    #find array with ST.find which returns Var(Array)
-    array = find(array_name)
-    #setting up the values in the array
-    for i in range (len(inputList)):
+def genForArray(array, inputList):
+    #a list of constants is placed in a data segment, identical lists share one segment
+    if all(type(x) == Const for x in inputList):
+        size = array.tp.base.size
+        d = b''.join((int(x.val) & 0xffffffff).to_bytes(4, 'little')[:size] for x in inputList)
+        array.lev, array.adr = -2, genData(d)
+        return
+    #generate global variables (array), the array is the only one added
+    genGlobalVars([array], 0)
+    #setting up the values in the array, from the last one, as the code for values that
+    #are on the stack has been generated in the order of the list
+    for i in reversed(range(len(inputList))):
         #genVar(array) to copy
         array_copy = genVar(array)
         #index Const with tp = Int, value = i
@@ -421,49 +880,35 @@ def genForArray(array_name, inputList):
         #put value in the array; array[i] := user_input[i]
         genAssign(item_in_array, value.val)
     
+'''
+Procedure genData(d) returns the address of a data segment with the bytes d, which is
+initialized when the module is instantiated. If a data segment with the same bytes has
+been generated before, its address is returned, otherwise memory for d is reserved.
+'''
+
+def genData(d):
+    global memsize
+    if d not in data: data[d], memsize = memsize, memsize + len(d)
+    return data[d]
+
 #genForInit generates while loop before the expression() stuff
-def genForInit(x, array_name, var_name, ArrayLength):
-    global curlev
-    global asm
-    #increment current level because why not
-    curlev = curlev + 1
-    #generate local variable
-    genLocalVars(topScope(), len(topScope())-1)
-    #######################################
-    ##adding local var declaration to right after func call;;;
-    ###it works for fn with procedure too
-    ##############################
-    array= asm
-    local_decl = array[-1]
-    array.pop(-1)
-    temp=[]
-    for value in array[::-1]:
-        if "func $" in value:
-            index = array.index(value)
-            temp.extend(array[:index + 1])
-            #append because it is single array
-            temp.append(local_decl)
-            temp.extend(array[index + 1:])
-            break;
-    asm = temp
-    
-    
- 
+def genForInit(x, array, counter, ArrayLength):
+    #declare local variable of the current function
+    counter.lev = curlev
+    genLocalVars([counter], 0)
     #setting temp_var to 0; temp_Var := 0
     index = Const(Int, 0)
-    temp_val = find(var_name)
-    temp_val = genVar(temp_val)
+    temp_val = genVar(counter)
     genAssign(temp_val, index)
     #loop
-    asm.append('loop')
+    emit(LOOP)
     ###index = length of list
     index = Const(Int, ArrayLength)
     ##temp_var < length of list
     genRelation(LT, temp_val, index)
     #if
-    asm.append('if')
+    emit(IF)
     ###ident := tempArray[tempindex]
-    array = find(array_name)
     array_copy = genVar(array)
     #array[temp_val]
     item_in_array = genIndex(array_copy,temp_val)
@@ -476,131 +921,160 @@ def genForInit(x, array_name, var_name, ArrayLength):
     
 #genForEnd for ending the loop
 def genForEnd():
-    global curlev
-    #current level goes down;
-    curlev = curlev - 1
-    asm.append('br 1')
-    asm.append('end')
-    asm.append('end')
-    
-#genCaseInit for initializing counter variable and else variable
-def genCaseInit(counter_name, else_name):
-    global asm
-    global curlev
-    curlev = curlev + 1
-    #len(topScope())-2 because generating two variables
-    genLocalVars(topScope(), len(topScope())-2)
-    #######################################
-    ##adding local var declaration to right after func call;;;
-    ###it works for fn with procedure too
-    ##############################
-    array= asm
-    local_decl = array[-2:]
-    array.pop(-1)
-    array.pop(-1)
-    temp=[]
-    for value in array[::-1]:
-        if "func $" in value:
-            index = array.index(value)
-            temp.extend(array[:index + 1])
-            #extend it because it is an array
-            temp.extend(local_decl)
-            temp.extend(array[index + 1:])
-            break;
-    asm = temp
-    #set the else variable to 1, which states it has to go to else loop
-    #Const one for integer
-    one = Const(Int, 1)
-    #find the local Var with else_name
-    temp_val = find(else_name)
-    temp_val = genVar(temp_val)
-    genAssign(temp_val, one)
-    
-#genCaseArray with input (x.Var)
-def genCaseArrayLoopInit(x, array_name, inputList, counter_name, else_name):
-    #len(topScope())-1 because generating one variables(array)
-    genGlobalVars(topScope(), len(topScope())-1)
-    ####generating the array with values from the inputList
-    #find array with ST.find which returns Var(Array)
-    array = find(array_name)
-    #setting up the values in the array
-    for i in range (len(inputList)):
-        #genVar(array) to copy
-        array_copy = genVar(array)
-        #index Const with tp = Int, value = i
-        index = Const(Int, i)
-        #value from the user input list
-        value = Const(Int, inputList[i])
-        #item_in_array = address of array[i];
-        item_in_array = genIndex(array_copy,index)
-        #put value in the array; array[i] := user_input[i]
-        genAssign(item_in_array, value.val)
-    #set the counter variable to 0.
-    #Const one for integer
-    zero = Const(Int, 0)
-    #find the local Var with else_name
-    temp_val = find(counter_name)
-    counter_var = genVar(temp_val)
-    genAssign(counter_var, zero)
-    #######################starting loop
-    #outer loop
-    asm.append('loop')
-    ###index = length of list
-    index = Const(Int, len(inputList))
-    ##temp_var < length of list
-    genRelation(LT, counter_var, index)
-    #if temp_var < length of list, get the array[temp_var] and
-    #compare it with x and if it is equal, do the statements
-    asm.append('if')
-    ###ident := tempArray[tempindex]
-    array = find(array_name)
-    array_copy = genVar(array)
-    item_in_array = genIndex(array_copy,temp_val)
-    #if array[temp_var] == x
-    genRelation(EQ, item_in_array, x)
-    #if statement to check array[temp_var] == x
-    asm.append('if')
-    ## if it is equal, case statement has executed, and else part doesn't
-    ## needs to be executed
-    #Const one for integer
-    zero = Const(Int, 0)
-    #find the local Var with else_name
-    temp_val = find(else_name)
-    temp_val = genVar(temp_val)
-    genAssign(temp_val, zero)
-    
-##genCaseArrayLoopEnd for ending if statement and loop
-##also incrementing counter up 1
-def genCaseArrayLoopEnd(counter_name):
-    ##break the if statement
-    asm.append('end')
-    ####tempindex = tempindex + 1
-    temp_val = find(counter_name)
-    counter_var = genVar(temp_val)
-    one = Const(Int, 1)
-    genAssign(temp_val, genBinaryOp(PLUS, counter_var, one))
-    ##break the while loop
-    asm.append('br 1')
-    asm.append('end')
-    asm.append('end')
+    emit(BR, 1)
+    emit(END)
+    emit(END)
     
-#genCaseElseInit for checking if any of the case statement has been
-#executed, and if so, var else should be set to 0
-def genCaseElseInit(else_name):
-    #Const one for integer
-    one = Const(Int, 1)
-    #if else var is still set to 1, execute the else part
-    #find the local Var with else_name
-    temp_val = find(else_name)
-    temp_val = genVar(temp_val)
-    genRelation(EQ, temp_val, one)
-    asm.append('if')
-
-#genCaseElseEnd for closing if statement generated by genCaseElseInit
-def genCaseElseEnd():
-    asm.append('end')
-    
-    
-def genCaseEnd():
-    global curlev
-    curlev = curlev - 1
\ No newline at end of file
+'''
+Procedure genTemp() allocates a temporary local variable of the current function and returns
+it as Var. The names of temporary variables contain an underscore, so they are distinct from
+P0 identifiers.
+'''
+
+def genTemp():
+    global temps
+    t = Var(Int); t.lev, t.name, temps = curlev, 'temp_' + str(temps), temps + 1
+    code.declare(t.name)
+    return t
+
+'''
+Procedures genForTo(x, z, up) and genForNext(x, z, up) generate code for the counted loop
+for x := y to z do s, or for x := y downto z do s if up is False, assuming that code for
+x := y has already been generated. The final value z is evaluated once into a temporary 
+variable t, unless z is Const, and the loop is left before x is incremented or decremented 
+past t, such that x does not overflow:
+
+    block
+      x > t, or x < t            genForTo(x, z, up) returns t
+      br_if 0
+      loop
+        s
+        x = t
+        br_if 1
+        x := x + 1, or x := x - 1    genForNext(x, t, up)
+        br 0
+      end
+    end
+'''
+
+def genForTo(x, z, up):
+    if type(z) != Const:
+        t = genTemp(); genAssign(t, z); z = t
+    emit(BLOCK)
+    genRelation(GT if up else LT, x, z)
+    emit(BRIF, 0)
+    emit(LOOP)
+    return z
+
+def genForNext(x, z, up):
+    genRelation(EQ, x, z)
+    emit(BRIF, 1)
+    genAssign(x, genBinaryOp(PLUS if up else MINUS, x, Const(Int, 1)))
+    emit(BR, 0)
+    emit(END)
+    emit(END)
+
+'''
+Procedures genCaseInit(x), genCaseArm(c, labels), genCaseArmEnd(c), genCaseElse(c) and
+genCaseEnd(c) generate code for case x of labels0: s0; ...; labelsn-1: sn-1 else s end.
+The case statement is compiled to nested blocks, one for each case, one for the else part
+and one for the whole statement; the innermost block dispatches on x to the end of the block
+of the matching case, after which the statement of that case follows:
+
+    block                           genCaseInit(x) reserves the place of the blocks
+      block                         and of the dispatch code
+        block
+          ...
+            block
+              dispatch on x         genCaseEnd(c)
+            end                     genCaseArm(c, labels0)
+            s0
+            br n                    genCaseArmEnd(c)
+            ...
+          end                       genCaseArm(c, labelsn-1)
+          sn-1
+          br 1                      genCaseArmEnd(c)
+        end                         genCaseElse(c)
+        s
+      end                           genCaseEnd(c)
+
+As the labels of all cases are known only at the end of the case statement, the blocks and the
+dispatch code are generated by genCaseEnd(c) at the place reserved by genCaseInit(x), and the
+branches out of the cases are completed there as well. Object c of class Case keeps:
+
+-sel, the item for x: if x is not Const or a variable, x is assigned to a temporary variable
+ of the type of x
+-start, the index of the reserved place in the instructions of the current function
+-arms, a dictionary from each label to the number of its case
+-exits, the indices of the branches out of the cases
+-els, whether the case statement has an else part
+
+The dispatch is a br_table if the labels are dense, otherwise a binary search over the labels.
+'''
+
+class Case:
+    def __init__(self, sel, start):
+        self.sel, self.start, self.arms, self.exits, self.els = sel, start, {}, [], False
+
+def genCaseInit(x):
+    if type(x) != Const and (type(x) != Var or x.lev == -1):
+        t = genTemp(); t.tp = x.tp; genAssign(t, x); x = t
+    return Case(x, len(code.ops))
+
+def genCaseArm(c, labels):
+    for l in labels:
+        if int(l.val) in c.arms: mark('multiple case label')
+        else: c.arms[int(l.val)] = len(c.exits)
+    emit(END)
+
+def genCaseArmEnd(c):
+    c.exits.append(len(code.ops))
+    emit(BR)
+
+def genCaseElse(c):
+    c.els = True
+    emit(END)
+
+def genCaseEnd(c):
+    n = len(c.exits)
+    if not c.els: emit(END)
+    emit(END)
+    for i in range(n): code.args[c.exits[i]] = n - i
+    start = len(code.ops)
+    for i in range(n + 2): emit(BLOCK)
+    labels = sorted(c.arms.items())
+    if len(labels) >= 4 and labels[-1][0] - labels[0][0] < 3 * len(labels):
+        lo, hi = labels[0][0], labels[-1][0]
+        table = [c.arms.get(v, n) for v in range(lo, hi + 1)]
+        loadItem(c.sel)
+        if lo != 0:
+            emit(I32CONST, lo)
+            emit(I32SUB)
+        code.tables.append(table + [n])
+        emit(BRTABLE, len(code.tables) - 1)
+    else: genCaseSearch(c.sel, labels, n, 0)
+    ops, args = code.ops[start:], code.args[start:]
+    del code.ops[start:], code.args[start:]
+    code.ops[c.start:c.start], code.args[c.start:c.start] = ops, args
+
+'''
+Procedure genCaseSearch(x, labels, n, d) generates code for branching to the block of the 
+case with label x, where labels is the sorted list of pairs of labels and case numbers, 
+n is the number of cases, and d is the number of if instructions enclosing the code. 
+Ranges of up to four labels are compared in sequence; otherwise, the range is split.
+'''
+
+def genCaseSearch(x, labels, n, d):
+    if len(labels) <= 4:
+        for v, i in labels:
+            genRelation(EQ, x, Const(Int, v))
+            emit(BRIF, i + d)
+        emit(BR, n + d)
+    else:
+        m = len(labels) // 2
+        genRelation(LT, x, Const(Int, labels[m][0]))
+        emit(IF)
+        genCaseSearch(x, labels[:m], n, d + 1)
+        emit(ELSE)
+        genCaseSearch(x, labels[m:], n, d + 1)
+        emit(END)
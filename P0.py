@@ -7,6 +7,9 @@ This collection of jupyter notebooks develops a compiler for P0, a subset of Pas
 The compiler generates MIPS code, but is modularized to facilitate other targets. 
 Pascal is a language that was designed with ease of compilation in mind; 
 the MIPS architecture is representative of Reduced Instruction Set Computing (RISC) processors.
+The modules are maintained in the .py files, which are imported in place of the notebooks: 
+SC.ipynb, ST.ipynb, P0.ipynb and CGwat.ipynb hold the original version and are not updated, 
+and CGwasm and CGast have no notebooks.
 '''
 
 '''
@@ -50,6 +53,9 @@ program ::= "program" ident ";" declarations compoundStatement.
 '''
 #The scanner and symbol table are always imported. Depending on the selected target,
 # a different code generator is imported when compilation starts.
+import argparse, builtins, hashlib, io, json, os, struct, sys, tempfile, threading, time, types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import nbimporter
 nbimporter.options["only_defs"] = False
 import SC  #  used for SC.init, SC.sym, SC.val, SC.error
@@ -62,6 +68,8 @@ import ST  #  used for ST.init
 from ST import Var, Ref, Const, Type, Proc, StdProc, Int, Bool, Enum, \
     Record, Array, newDecl, find, openScope, topScope, closeScope, printSymTab
 
+SRCDIR = os.path.dirname(os.path.abspath(__file__))
+
 #The first and follow sets for recursive descent parsing.
 FIRSTFACTOR = {IDENT, NUMBER, LPAREN, NOT, TILDE}
 FOLLOWFACTOR = {TIMES, DIV, MOD, AND, OR, PLUS, MINUS, EQ, NE, LT, LE, GT, GE,
@@ -100,7 +108,9 @@ def selector(x):
                     if type(y) == Const and \
                        (y.val < x.tp.lower or y.val >= x.tp.lower + x.tp.length):
                         mark('index out of bounds')
-                    else: x = CG.genIndex(x, y)
+                    else:
+                        if indexChecks and type(y) != Const: y = CG.genCheck(x, y)
+                        x = CG.genIndex(x, y)
                 else: mark('index not integer')
             else: mark('not an array')
             if SC.sym == RBRAK: getSym()
@@ -289,23 +299,17 @@ def finalValue():
 #Procedure case() parses
 #	case :: = constList ":" statement
 
-def case(x, counter_name, else_name):
-    global array_num
-    y, inputList = constList()
-    #inorder to push it to the stack; get the ST.Array
-    array_tp = y.val;
-    #array_name starting from for_array_0
-    array_name = "for_array_"+str(array_num)
-    #declare it, and will create global variable in genForArray()
-    newDecl(array_name, Var(array_tp))
-    #increment array number
-    array_num += 1
-    #call genForArray with name of the array, user input array
-    CG.genCaseArrayLoopInit(x, array_name, inputList, counter_name, else_name)
+def case(c):
+    y, labels = constList()
+    #case labels must be constants of the type of the case expression
+    for l in labels:
+        if type(l) != Const: mark('constant expected')
+        elif l.tp != c.sel.tp: mark('bad type')
+    CG.genCaseArm(c, [l for l in labels if type(l) == Const])
     if SC.sym == COLON:
         getSym()
         a = statement()
-        CG.genCaseArrayLoopEnd(counter_name)
+        CG.genCaseArmEnd(c)
     else:
         mark("colon (:) expected from case function")
 
@@ -314,12 +318,11 @@ def case(x, counter_name, else_name):
 #Procedure elsePart() parses
 #	elsePart ::= ("else"|"otherwise") statementlist
 
-def elsePart(else_name):
+def elsePart(c):
     if (SC.sym == ELSE or SC.sym == OTHERWISE):
         getSym()
-        CG.genCaseElseInit(else_name)
+        CG.genCaseElse(c)
         x = statementList()
-        CG.genCaseElseEnd()
     else:
         mark("else or otherwise expected from elsePart function")
 
@@ -446,9 +449,9 @@ def statement():
                 #array_name starting from for_array_0
                 array_name = "for_array_"+str(array_num)
                 #declare it, and will create global variable in genForArray()
-                newDecl(array_name, Var(array_tp))
-                #call genForArray with name of the array, user input array
-                CG.genForArray(array_name, inputList)
+                array = Var(array_tp); newDecl(array_name, array)
+                #call genForArray with the array, user input array
+                CG.genForArray(array, inputList)
                 #open the scope to store local variable 
                 openScope()
                 #temp variable name starting from counter_0
@@ -457,9 +460,9 @@ def statement():
                 temp_var = Var(Int)
                 #declare it, will create local variable in genForInit()
                 newDecl(var_name, temp_var)
-                #call genForInit with controlVariable(ident, array_name,
-                #var_name, length of input Array)
-                CG.genForInit(x, array_name, var_name, len(inputList))
+                #call genForInit with controlVariable(ident, array,
+                #temp_var, length of input Array)
+                CG.genForInit(x, array, temp_var, len(inputList))
                 #increment array number so it doesn't declare same array name
                 #if we have more than 1 array / variable
                 array_num += 1
@@ -480,63 +483,24 @@ def statement():
         ###for controlVariable :=
         elif SC.sym == BECOMES:
             getSym()
-            #init_value = initialValue; int value hopefully
-            init_value = initialValue().val
+            #x := initialValue, the bounds are arbitrary integer expressions
+            y = initialValue()
+            if x.tp == Int == y.tp: CG.genAssign(x, y)
+            else: mark('integer expected')
             if (SC.sym == TO or SC.sym == DOWNTO):
                 #set goes up to True if "to"; set to False if "downto"
-                if (SC.sym == TO): goes_up = True;
-                else: goes_up = False;
+                goes_up = SC.sym == TO
                 getSym()
-                #final_value = finalValue()
-                final_value = finalValue().val
-                #####setting up the array
-                #input List having init_value to final_value
-                inputList = []
-                ####create list according goes_up
-                if (init_value <= final_value and goes_up):
-                    #create the list
-                    while (init_value <= final_value):
-                        inputList.append(Const(Int, init_value))
-                        init_value = init_value + 1
-                elif(init_value >= final_value and not goes_up):
-                    #create the list
-                    while (init_value >= final_value):
-                        inputList.append(Const(Int, init_value))
-                        init_value = init_value - 1
-                #if user gives wrong combination of ("to/downto") and initialValue  and finalValue        
-                else: mark("can't go upto "+str(final_value)+" from "+str(init_value)+" or vise versa")
-                #make Type(Array) so we can pass it to the function
-                y = Type(CG.genArray(Array(inputList[0].tp, 0, len(inputList)-1)))
-                #inorder to push it to the stack; get the ST.Array
-                array_tp = y.val;
-                #array_name starting from for_array_0
-                array_name = "for_array_"+str(array_num)
-                #declare it, and will create global variable in genForArray()
-                newDecl(array_name, Var(array_tp))
-                #call genForArray with name of the array, user input array
-                CG.genForArray(array_name, inputList)
-                #open the scope to store local variable 
-                openScope()
-                #temp variable name starting from counter_0
-                var_name = "counter_"+str(array_num)
-                #Var int to initialize
-                temp_var = Var(Int)
-                #declare it, will create local variable in genForInit()
-                newDecl(var_name, temp_var)
-                #call genForInit with controlVariable(ident, array_name,
-                #var_name, length of input Array)
-                CG.genForInit(x, array_name, var_name, len(inputList))
-                #increment array number so it doesn't declare same array name
-                #if we have more than 1 array / variable
-                array_num += 1
+                #final value is evaluated once, before the first iteration
+                z = finalValue()
+                if z.tp == Int: z = CG.genForTo(x, z, goes_up)
+                else: mark('integer expected')
                 if SC.sym == DO: getSym()
                 else: mark("'do' expected from for loop")
                 #statement() prints all the stuff b/w begin and end
                 statement()
-                #genForEnd() to close the loop
-                CG.genForEnd()
-                #closeScope -> popping the local variable after the loop
-                closeScope()
+                #genForNext() to increment or decrement x and close the loop
+                if z.tp == Int: CG.genForNext(x, z, goes_up)
                 
             else:
                 mark("to or downto expected from for loop")
@@ -547,43 +511,24 @@ def statement():
         getSym()
         #x = expression
         x = expression()
-        #open the scope because all the stuff will be a local Var
-        openScope()
-        #Counter variable for indexing array returned by constList
-        counter_name = "counter_"+str(array_num)
-        #Var int to initialize
-        temp_var = Var(Int)
-        #declare counter variable
-        newDecl(counter_name, temp_var)
-        #else variable to track if any case matches expression.
-        else_name = "else_"+str(array_num)
-        #Var int to initialize
-        temp_var = Var(Int)
-        #declare else variable
-        newDecl(else_name, temp_var)
-        #increment array_num 
-        array_num += 1
-        #call CG.genCaseInit()
-        CG.genCaseInit(counter_name, else_name)
+        if x.tp not in {Int, Bool}: mark('bad type')
+        #c collects the labels and statements of the cases for CG
+        c = CG.genCaseInit(x)
         if SC.sym == OF:
             getSym()
-            #call case where array for each case will be initialized
-            #it needs counter name and else name in order to make a loop
-            case(x, counter_name, else_name)
+            case(c)
             while SC.sym == SEMICOLON:
                 if (SC.sym == SEMICOLON):
                     getSym()
-                case(x, counter_name, else_name)
-            #elsePart needs variable else to check if else is set to
-            #0 or 1. if set to 0, execute statementList else not
-            elsePart(else_name)
+                if SC.sym in {ELSE, OTHERWISE, END}: break
+                case(c)
+            #elsePart is optional
+            if SC.sym in {ELSE, OTHERWISE}: elsePart(c)
             ###the last semicolon is taken care from elsePart -> statementlist
             if SC.sym == END:
                 getSym() 
-                #for setting current level back to original
-                CG.genCaseEnd()
-                #close the scope
-                closeScope()
+                #generate the dispatch to the cases
+                CG.genCaseEnd(c)
             else:
                 mark("end expected from case statement")
         else:
@@ -660,6 +605,51 @@ def typedIds(kind):
     else: mark("':' expected")
 
 
+#With incremental compilation, the function of a procedure that is unchanged since the last 
+#compilation, with the same P0 instance, is reused instead of parsing and generating its body.
+#Procedures are identified by procKey(start, i), where the procedure starts at symbol start 
+#of SC.syms and its body at symbol i: the key consists of the lexemes of the procedure, the 
+#description by describe(name) of each identifier in the procedure as it is visible before 
+#the body, with descriptions kept in descs during a compilation, whether indices are checked, 
+#and the state of the code generator on which the body depends, as returned by CG.procKey. The key is returned with the index of the symbol that 
+#follows the body, as determined by procSpan(i), or (None, None) if the procedure contains 
+#procedure declarations, which are not supported for incremental compilation. The saved 
+#functions of the last compilation are in procPrev and those of the current one in procCache, 
+#such that functions of procedures that no longer exist are dropped. The body of a procedure 
+#is not saved if an error was reported or it contained a for-in statement over a list, as the 
+#code generator declares global variables or data segments for these.
+
+procCache, procPrev, descs, incremental = {}, {}, {}, False
+
+def procSpan(i):
+    syms, depth, body = SC.syms, 0, False
+    while syms[i] != EOF:
+        if syms[i] in (BEGIN, CASE, RECORD):
+            body, depth = body or syms[i] == BEGIN and depth == 0, depth + 1
+        elif syms[i] == END:
+            depth -= 1
+            if depth < 0: return None
+            if depth == 0 and body: return i + 1
+        elif syms[i] == PROCEDURE: return None
+        i += 1
+    return None
+
+def describe(name):
+    decls = ST.names.get(name)
+    if not decls: return None
+    e = decls[-1][1]
+    if e not in descs: descs[e] = type(e).__name__, str(e), getattr(e, 'adr', None)
+    return descs[e]
+
+def procKey(start, i):
+    end = procSpan(i)
+    if end == None: return None, None
+    lexemes = SC.vals[start:end]
+    idents = sorted({v for sym, v in zip(SC.syms[start:end], lexemes) if sym == IDENT})
+    env = tuple(describe(n) for n in idents)
+    return (tuple(lexemes), env, indexChecks, CG.procKey(idents)), end
+
+
 #Procedure declarations(allocVar) parses
 #declarations ::=
 #    {"const" ident "=" expression ";"}
@@ -701,7 +691,7 @@ def declarations(allocVar):
         else: mark("; expected")
     varsize = allocVar(topScope(), start)
     while SC.sym == PROCEDURE:
-        getSym()
+        start = SC.cur if incremental and SC.syms is not None else None; getSym()
         if SC.sym == IDENT: getSym()
         else: mark("procedure name expected")
         ident = SC.val; newDecl(ident, Proc([])) #  entered without parameters
@@ -725,9 +715,16 @@ def declarations(allocVar):
         parsize = CG.genProcStart(ident, fp)
         if SC.sym == SEMICOLON: getSym()
         else: mark("; expected")
-        localsize = declarations(CG.genLocalVars)
-        CG.genProcEntry(ident, parsize, localsize)
-        x = compoundStatement(); CG.genProcExit(x, parsize, localsize)
+        key, end = procKey(start, SC.cur) if start != None else (None, None)
+        if key in procPrev and CG.reuseProc(procPrev[key]): #  body skipped
+            procCache[key] = procPrev[key]; SC.skip(end)
+        else:
+            state, num = CG.procState() if key else None, array_num
+            localsize = declarations(CG.genLocalVars)
+            CG.genProcEntry(ident, parsize, localsize)
+            x = compoundStatement(); CG.genProcExit(x, parsize, localsize)
+            saved = CG.saveProc(state) if key and not SC.error and array_num == num else None
+            if saved: procCache[key] = saved
         closeScope() #  scope for parameters and body closed
         if SC.sym == SEMICOLON: getSym()
         else: mark("; expected")
@@ -758,47 +755,362 @@ def program():
     return CG.genProgExit(x)
 
 
-#Procedure compileString(src, dstfn, target) compiles the source as given by string src; 
-#if dstfn is provided, the code is written to a file by that name, 
-#otherwise printed on the screen. If target is omitted, MIPS code is generated.    
-
-def compileString(src, dstfn = None, target = 'wat'):
-    global CG
+#Procedure generate(src, target, checks, buffered, prefetch, incr) compiles the source as given by 
+#string src with the code generator for target and returns the generated code, or None if an 
+#error was reported. If checks is True, the code checks at run time that indices which are not 
+#constant are within the bounds of the array: then indexChecks is True and selector calls 
+#CG.genCheck. If buffered is True, the WebAssembly code collects the output in memory and passes 
+#it to the host with flush(ptr, len) instead of calling write and writeln; if prefetch is True,
+#it fetches all input into memory with input(ptr) instead of calling read for each integer, see 
+#CGwat.buffered and CGwat.prefetch. If incremental is True and the target is 'wat' or 'wasm', 
+#the functions of unchanged procedures are taken from the previous compilation, see procKey.
+#It uses the scanner, symbol table and code generator modules that P0 imports; it is called 
+#through a CompilerContext, which provides its own instances of these modules.
+
+def generate(src, target, checks = False, buffered = False, prefetch = False, incr = False):
+    global CG, indexChecks, incremental, procCache, procPrev, descs
+    indexChecks = checks
+    incremental = incr and target in ('wat', 'wasm')
+    procPrev, procCache, descs = procCache if incremental else {}, {}, {}
     #array_num###
     global array_num
     array_num = 0
     if target == 'wat': import CGwat as CG
+    elif target == 'wasm': import CGwasm as CG
     elif target == 'mips': import CGmips as CG
     elif target == 'ast': import CGast as CG
     else: print('unknown target'); return
+    if target in ('wat', 'wasm', 'ast'):
+        import CGwat; CGwat.buffered, CGwat.prefetch = buffered, prefetch
     SC.init(src)
     ST.init()
     p = program()
-    if p != None and not SC.error:
+    if p != None and not SC.error: return p
+
+
+#Class CompilerContext owns the state of a compilation. As the scanner, symbol table and 
+#code generators keep their state in module variables, a context executes the modules of 
+#the compiler, which are the .py files in the directory of P0, once more in namespaces of 
+#its own; within these, importing a module of the compiler gives the instance of the context.
+#The code of the modules is compiled only once and shared by all contexts. Contexts do not 
+#share any state, so compilations in separate contexts can run concurrently, e.g. from a 
+#thread pool. A context can be used for consecutive compilations:
+#
+#-module(name) returns the instance of compiler module name, loading it if necessary
+#-compile(src) returns the generated code for src, or None if an error was reported;
+# if checks is True, the code checks indices at run time, if buffered is True, the output 
+# is buffered, and if prefetch is True, the input is prefetched, see generate
+#-messages is the list of error messages of the last compilation; if echo is True,
+# they are also printed as they are reported
+#-cache is a CompileCache or None; if the code and messages for src, the target and the 
+# options are in cache, compile(src) takes them from there, otherwise it adds them. Changes 
+# to the compiler modules through module(name) are not reflected in the key and should not 
+# be made in contexts with a cache.
+#-if incremental is True, consecutive compilations reuse the code of unchanged procedures, 
+# see generate
+
+class CompilerContext:
+    codes = {} # code objects of the compiler modules by name
+    def __init__(self, target = 'wat', echo = True, checks = False, buffered = False, 
+                 prefetch = False, cache = None, incremental = False):
+        self.target, self.echo, self.modules, self.messages = target, echo, {}, []
+        self.checks, self.buffered, self.prefetch, self.cache = checks, buffered, prefetch, cache
+        self.incremental = incremental
+        self.builtins = dict(vars(builtins), __import__ = self.importModule)
+    def importModule(self, name, globals = None, locals = None, fromlist = (), level = 0):
+        if level == 0 and os.path.isfile(os.path.join(SRCDIR, name + '.py')):
+            return self.module(name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+    def module(self, name):
+        if name not in self.modules:
+            if name not in CompilerContext.codes:
+                fn = os.path.join(SRCDIR, name + '.py')
+                with open(fn, 'r') as f: CompilerContext.codes[name] = compile(f.read(), fn, 'exec')
+            m = self.modules[name] = types.ModuleType(name)
+            m.__file__, m.__builtins__ = os.path.join(SRCDIR, name + '.py'), self.builtins
+            exec(CompilerContext.codes[name], vars(m))
+        return self.modules[name]
+    def compile(self, src):
+        options = (self.checks, self.buffered, self.prefetch)
+        key = self.cache.key(src, self.target, options) if self.cache else None
+        entry = self.cache.get(key) if key else None
+        if entry:
+            p, self.messages = entry
+            if self.echo:
+                for m in self.messages: print(m)
+            return p
+        sc = self.module('SC'); sc.echo = self.echo
+        p0 = self.module('P0')
+        try: p = p0.generate(src, self.target, *options, self.incremental)
+        finally: self.messages = getattr(sc, 'messages', [])
+        if key: self.cache.put(key, p, self.messages)
+        return p
+
+
+#Class CompileCache is a persistent cache of compilations in directory dir. The generated 
+#code and the error messages are stored under a key that is the hash of the source, the 
+#target, the options and the version of the compiler, which is the hash of the source of the 
+#compiler modules in COMPILER, as returned by compilerVersion(). An entry is a file dir/kk/rest
+#for key kk + rest, with a line with the kind of the code, 'str', 'bytes' or 'none' if no code
+#was generated, and the messages in JSON, followed by the code. Entries are written to a 
+#temporary file that is then renamed, so that concurrent compilations, e.g. by the worker 
+#processes of compileMany, never see partial entries. The modification time of an entry is 
+#the time of its last use. When the entries take more than maxsize bytes, the least recently 
+#used ones are removed until they take at most 3/4 of maxsize. The size of the entries is 
+#determined by scanning dir at the first addition and then maintained by put(key, code, 
+#messages); entries added by other processes are accounted for at the next scan. Failures to 
+#read or write the cache are treated as misses.
+#
+#-key(src, target, options) returns the key for source src, target and tuple options
+#-get(key) returns the pair of the code and messages stored under key, or None
+#-put(key, code, messages) stores code and messages under key
+
+COMPILER = ('SC', 'ST', 'P0', 'CGwat', 'CGwasm', 'CGast', 'CGmips')
+CACHESIZE = 2**28
+version = None
+
+def compilerVersion():
+    global version
+    if version == None:
+        h = hashlib.sha256()
+        for name in COMPILER:
+            fn = os.path.join(SRCDIR, name + '.py')
+            if os.path.isfile(fn):
+                with open(fn, 'rb') as f: h.update(name.encode() + b'\0' + f.read())
+        version = h.hexdigest()
+    return version
+
+class CompileCache:
+    def __init__(self, dir, maxsize = CACHESIZE):
+        self.dir, self.maxsize, self.size = dir, maxsize, None
+    def key(self, src, target, options):
+        h = hashlib.sha256(repr((compilerVersion(), target, options)).encode() + b'\0')
+        h.update(src.encode('utf-8'))
+        return h.hexdigest()
+    def path(self, key):
+        return os.path.join(self.dir, key[:2], key[2:])
+    def get(self, key):
+        fn = self.path(key)
+        try:
+            with open(fn, 'rb') as f: kind, messages = json.loads(f.readline()); code = f.read()
+        except (OSError, ValueError): return None
+        try: os.utime(fn)
+        except OSError: pass
+        return (None if kind == 'none' else code if kind == 'bytes' else code.decode('utf-8')), messages
+    def put(self, key, code, messages):
+        kind = 'none' if code == None else 'bytes' if type(code) == bytes else 'str'
+        data = (json.dumps([kind, messages]) + '\n').encode() + \
+               (b'' if code == None else code if kind == 'bytes' else code.encode('utf-8'))
+        fn = self.path(key)
+        try: old = os.stat(fn).st_size #  of the entry that is replaced
+        except OSError: old = 0
+        try:
+            os.makedirs(os.path.dirname(fn), exist_ok = True)
+            fd, tmp = tempfile.mkstemp(dir = os.path.dirname(fn), prefix = '.')
+            try:
+                with os.fdopen(fd, 'wb') as f: f.write(data)
+                os.replace(tmp, fn)
+            except OSError: os.remove(tmp); raise
+        except OSError: return
+        if self.size == None: self.size = sum(size for t, size, fn in self.entries())
+        else: self.size += len(data) - old
+        if self.size > self.maxsize: self.evict()
+    def entries(self):
+        es = []
+        for d in os.scandir(self.dir):
+            if d.is_dir():
+                for e in os.scandir(d.path):
+                    if not e.name.startswith('.'):
+                        try: st = e.stat(); es.append((st.st_mtime, st.st_size, e.path))
+                        except OSError: pass
+        return es
+    def evict(self):
+        es = sorted(self.entries()); self.size = sum(size for t, size, fn in es)
+        for t, size, fn in es:
+            if self.size <= self.maxsize * 3 // 4: break
+            try: os.remove(fn); self.size -= size
+            except OSError: pass
+
+
+#Procedure compileString(src, dstfn, target, checks, buffered, prefetch, cache) compiles the 
+#source as given by string src; if dstfn is provided, the code is written to a file by that name, 
+#otherwise printed on the screen. If target is omitted, MIPS code is generated.    
+#For target 'wasm', the code is a binary WebAssembly module. If checks is True, the code
+#traps when an index is out of bounds; if buffered is True, the output is buffered, and if
+#prefetch is True, the input is prefetched. If cache is a CompileCache, the code is taken 
+#from there if possible.
+
+def compileString(src, dstfn = None, target = 'wat', checks = False, buffered = False, 
+                  prefetch = False, cache = None):
+    p = CompilerContext(target, checks = checks, buffered = buffered, 
+                        prefetch = prefetch, cache = cache).compile(src)
+    if p != None:
         if dstfn == None: print(p)
         else:
-            with open(dstfn, 'w') as f: f.write(p);
+            with open(dstfn, 'wb' if type(p) == bytes else 'w') as f: f.write(p);
 
 
 
-#Procedure compileFile(srcfn, target) compiles the file named scrfn, 
+#Procedure compileFile(srcfn, target, checks, buffered, prefetch, cache) compiles the file named scrfn, 
 #which must have the extension .p, and generates assembly code in a file 
-#with extension .s. If target is omitted, MIPS code is generated.            
+#with extension .s, or a WebAssembly module with extension .wasm for target 'wasm'.
+#If target is omitted, MIPS code is generated.            
 
-def compileFile(srcfn, target = 'wat'):
+def compileFile(srcfn, target = 'wat', checks = False, buffered = False, prefetch = False,
+                cache = None):
     if srcfn.endswith('.p'):
         with open(srcfn, 'r') as f: src = f.read()
-        dstfn = srcfn[:-2] + '.s'
-        compileString(src, dstfn, target)
+        dstfn = srcfn[:-2] + ('.wasm' if target == 'wasm' else '.s')
+        compileString(src, dstfn, target, checks, buffered, prefetch, cache)
     else: print("'.p' file extension expected")
 
 
-
-
-
-
-
-
-
-
-
+#Class CompileResult is the outcome of compiling one file with compileMany: srcfn is the name 
+#of the source file, dstfn the name of the file with the generated code, or None if no code 
+#was generated, messages the list of error messages, and time the time in seconds for reading, 
+#compiling and writing the file.
+
+class CompileResult:
+    def __init__(self, srcfn, dstfn, messages, time):
+        self.srcfn, self.dstfn, self.messages, self.time = srcfn, dstfn, messages, time
+    def __str__(self):
+        return self.srcfn + ' -> ' + str(self.dstfn) + ' (' + format(1000 * self.time, '.1f') + \
+               ' ms)' + ''.join('\n  ' + m for m in self.messages)
+
+
+#Procedure compileMany(srcfns, target, jobs, checks, buffered, prefetch, cache) compiles each of
+#the files named in srcfns like compileFile(srcfn, target, checks, buffered, prefetch, cache) 
+#and returns the list of their CompileResult in the same order. The files are distributed over 
+#a pool of jobs worker processes, by default one per processor; with one job, the files are 
+#compiled in the current process. Each worker process imports the compiler and loads the 
+#compiler modules into a CompilerContext only once, in initWorker(target, checks, buffered, 
+#prefetch, cache), and then reuses that context in compileWorker(srcfn) for all the files that 
+#it compiles. With a cache, the modules are only loaded when a file is not found in the cache.
+
+def initWorker(target, checks = False, buffered = False, prefetch = False, cache = None):
+    global context
+    context = CompilerContext(target, echo = False, checks = checks, buffered = buffered,
+                              prefetch = prefetch, cache = cache)
+    if cache: return
+    for name in ('P0', 'CG' + target):
+        if os.path.isfile(os.path.join(SRCDIR, name + '.py')): context.module(name)
+
+def compileWorker(srcfn):
+    start = time.perf_counter()
+    if not srcfn.endswith('.p'):
+        return CompileResult(srcfn, None, ["'.p' file extension expected"], 0.0)
+    try:
+        with open(srcfn, 'r') as f: src = f.read()
+        p = context.compile(src)
+        dstfn = srcfn[:-2] + ('.wasm' if context.target == 'wasm' else '.s')
+        if p != None:
+            with open(dstfn, 'wb' if type(p) == bytes else 'w') as f: f.write(p)
+        else: dstfn = None
+        messages = context.messages
+    except OSError as e: dstfn, messages = None, [str(e)]
+    return CompileResult(srcfn, dstfn, messages, time.perf_counter() - start)
+
+def compileMany(srcfns, target = 'wat', jobs = None, checks = False, buffered = False, 
+                prefetch = False, cache = None):
+    srcfns = list(srcfns); jobs = jobs or os.cpu_count() or 1
+    initargs = (target, checks, buffered, prefetch, cache)
+    if jobs == 1 or len(srcfns) <= 1:
+        initWorker(*initargs); return [compileWorker(fn) for fn in srcfns]
+    chunksize = max(1, len(srcfns) // (4 * jobs))
+    with ProcessPoolExecutor(jobs, initializer = initWorker, initargs = initargs) as pool:
+        return list(pool.map(compileWorker, srcfns, chunksize = chunksize))
+
+
+#Procedure run(src, inputs, checks, buffered, prefetch) compiles the source as given by string 
+#src to a WebAssembly module in memory, runs it with pywasm, and returns the output as a string,
+#or None if an error was reported when compiling. The integers in list inputs are taken by 
+#read; integers are written in decimal without separator and writeln writes a newline, as by 
+#the P0lib of the JavaScript runtime. The host functions of P0lib implement all protocols for 
+#output and input, see CGwat: write, writeln, flush(ptr, len), read and input(ptr); flush and 
+#input access the memory of the calling module, as the instance is not returned before its 
+#start function $program ends. A trap, or a read beyond the inputs, raises an exception. With 
+#pywasm, host calls are cheaper than the interpreted code of buffered output and prefetched 
+#input, which are therefore not the default. Procedure runModule(desc, inputs) runs the 
+#decoded module desc in the same way, for modules that are not compiled by run.
+#
+#Procedure loadModule(src, checks, buffered, prefetch) returns the decoded module for run. The 
+#decoded modules are kept in runCache, in the order of their last use, under the hash of the 
+#source together with the options. A run of a source that is in runCache is neither 
+#compiled nor decoded, only instantiated, which executes $program. When runCache has more than 
+#RUNCACHE entries, the least recently used one is evicted; runLock guards runCache, so that 
+#run can be called from several threads.
+
+RUNCACHE = 64
+runCache, runLock = OrderedDict(), threading.Lock()
+
+def loadModule(src, checks, buffered, prefetch):
+    from pywasm import core
+    key = (hashlib.sha256(src.encode('utf-8')).digest(), checks, buffered, prefetch)
+    with runLock:
+        if key in runCache: runCache.move_to_end(key); return runCache[key]
+    context = CompilerContext('wasm', checks = checks, buffered = buffered, prefetch = prefetch)
+    p = context.compile(src)
+    if p == None: return None
+    desc = core.ModuleDesc.from_reader(io.BytesIO(p))
+    with runLock:
+        runCache[key] = desc
+        if len(runCache) > RUNCACHE: runCache.popitem(last = False)
+    return desc
+
+def run(src, inputs = (), checks = False, buffered = False, prefetch = False):
+    desc = loadModule(src, checks, buffered, prefetch)
+    return None if desc == None else runModule(desc, inputs)
+
+def runModule(desc, inputs = ()):
+    from pywasm import core
+    values, output = iter(inputs), []
+    def memory(m): return m.store.mems[m.stack.frame[-1].module.mems[0]] # of the caller
+    def write(m, args): output.append(str(args[0])); return []
+    def writeln(m, args): output.append('\n'); return []
+    def flush(m, args): output.append(memory(m).get(args[0], args[1]).decode()); return []
+    def read(m, args):
+        for v in values: return [v]
+        raise EOFError('P0: no more input')
+    def input(m, args):
+        mem, ptr, ints = memory(m), args[0], list(values)
+        data = bytearray(struct.pack('<%di' % len(ints), *ints))
+        if ptr + len(data) > mem.size * 65536: mem.grow((ptr + len(data) - 1) // 65536 + 1 - mem.size)
+        mem.put(ptr, data); return [len(ints)]
+    i32 = core.ValType.i32()
+    hosts = [('write', write, [i32], []), ('writeln', writeln, [], []), ('read', read, [], [i32]),
+             ('flush', flush, [i32, i32], []), ('input', input, [i32], [i32])]
+    runtime = core.Runtime()
+    runtime.imports['P0lib'] = {name: runtime.allocate_func_host(core.FuncType(params, results), f)
+                                for name, f, params, results in hosts}
+    runtime.instance(desc)
+    return ''.join(output)
+
+
+#When run as a script, P0 compiles the .p files given on the command line with compileMany 
+#and prints the result for each; the exit status is 1 if an error was reported for any file:
+#
+#    python P0.py [-t target] [-j jobs] [-c] [-b] [-p] [--cache dir] file.p ...
+#
+#where -c compiles with checks of the indices at run time, -b with buffered output and -p with 
+#prefetched input, and --cache takes the code from and adds it to a CompileCache in dir.
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'P0', description = 'Compile P0 programs.')
+    parser.add_argument('srcfns', nargs = '+', metavar = 'file.p')
+    parser.add_argument('-t', '--target', default = 'wat')
+    parser.add_argument('-j', '--jobs', type = int, default = None)
+    parser.add_argument('-c', '--checks', action = 'store_true')
+    parser.add_argument('-b', '--buffered', action = 'store_true')
+    parser.add_argument('-p', '--prefetch', action = 'store_true')
+    parser.add_argument('--cache', metavar = 'dir', default = None)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    cache = CompileCache(args.cache) if args.cache else None
+    results = compileMany(args.srcfns, args.target, args.jobs, args.checks, args.buffered,
+                          args.prefetch, cache)
+    for r in results: print(r)
+    print(len(results), 'files compiled in', format(time.perf_counter() - start, '.3f'), 's')
+    return 1 if any(r.dstfn == None for r in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
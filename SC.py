@@ -11,6 +11,11 @@ The scanner reads the characters of the source consecutively and recognizes symb
 Symbols are encoded by integer constants.
 '''
 
+import re
+from array import array
+from itertools import accumulate, chain, repeat
+from operator import itemgetter
+
 #FOR, IN, TO, DOWNTO, CASE, OTHERWISE has been added
 TIMES = 1; DIV = 2; MOD = 3; AND = 4; PLUS = 5; MINUS = 6
 OR = 7; EQ = 8; NE = 9; LT = 10; GT = 11; LE = 12; GE = 13
@@ -33,17 +38,30 @@ Following variables determine the state of the scanner:
 -if sym is NUMBER, val is the value of the number
 -if sym is IDENT, val is the identifier string
 -source is the string with the source program
+-messages is the list of error messages reported so far, which are also printed if echo is True
 
-The source is specified as a parameter to the procedure init:
+The source is specified as a parameter to the procedure init. By default, the whole
+source is tokenized in one pass by tokenize(src) and getSym() only advances over the
+recognized symbols; if bulk is False, the source is scanned character by character
+as symbols are requested:
 
+-syms, vals, ends are the symbols, lexemes and end indices returned by tokenize(src); 
+ syms is None if the source is scanned character by character
+-cur is the index of the current symbol in syms, or None if syms is None
 '''
-def init(src):
+
+echo = True
+
+def init(src, bulk = True):
     global line, lastline, errline, pos, lastpos, errpos
-    global sym, val, error, source, index
+    global sym, val, error, source, index, syms, vals, ends, cur, messages
     line, lastline, errline = 1, 1, 1
     pos, lastpos, errpos = 0, 0, 0
     sym, val, error, source, index = None, None, False, src, 0
-    getChar(); getSym()
+    messages = []
+    if bulk: syms, vals, ends = tokenize(src); cur = -1
+    else: syms, cur = None, None; getChar()
+    getSym()
 
 '''
 Procedure getChar() assigns the next character in ch, or assigns chr(0) at the end of the source. 
@@ -65,12 +83,15 @@ def getChar():
 '''
 Procedure mark(msg) prints an error message with the current location in the source. 
 To avoid a cascade of errors, only one error message at a source location is printed.
+If the source is tokenized, the location is only determined when an error is reported.
 '''       
 
 def mark(msg):
     global errline, errpos, error
+    if syms is not None: locate(ends[cur])
     if lastline > errline or lastpos > errpos:
-        print('error: line', lastline, 'pos', lastpos, msg)
+        messages.append('error: line ' + str(lastline) + ' pos ' + str(lastpos) + ' ' + msg)
+        if echo: print(messages[-1])
     errline, errpos, error = lastline, lastpos, True
 
 
@@ -136,22 +157,41 @@ def comment():
 
 
 '''
-Procedure getSym() parses
+Procedure getSym() advances to the next symbol of syms, or calls scanSym() if the 
+source is scanned character by character. Procedure scanSym() parses
 
 symbol ::= { blank } ( identKW | number | comment | '*' | '+' | '-' | '=' | '<>' |
                     '<' | '<=' | '>' | '>=' | ';' | ',' | ':' | '=' | '.' | '(' |  ')' | '[' | ']' | '~' | '&' | '|' )
 blank ::= chr(0) | … | ' '
 If a valid symbol is recognized, sym is set accordingly, otherwise an error is reported. 
 The longest match is used for recognizing operators. Blanks are skipped. 
-At the end of the source, sym is set to EOF.
+At the end of the source, sym is set to EOF. Procedure skip(i) advances to symbol i of syms,
+for skipping symbols that are not to be parsed.
 '''        
 
 def getSym():
+    global sym, val, cur
+    if syms is None: scanSym()
+    elif cur + 1 < len(syms):
+        cur += 1; sym = syms[cur]
+        if sym == NUMBER:
+            val = int(vals[cur])
+            if val >= 2**31: mark('number too large'); val = 0
+        elif sym < 0:
+            if sym == -2: mark('comment not terminated'); sym = EOF
+            else: mark('illegal character'); sym = None
+        elif vals[cur][0].isalpha(): val = vals[cur]
+
+def skip(i):
+    global cur
+    cur = i - 1; getSym()
+
+def scanSym():
     global sym
     while chr(0) < ch <= ' ': getChar()
     if 'A' <= ch <= 'Z' or 'a' <= ch <= 'z': identKW()
     elif '0' <= ch <= '9': number()
-    elif ch == '{': comment(); getSym()
+    elif ch == '{': comment(); scanSym()
     elif ch == '*': getChar(); sym = TIMES
     elif ch == '+': getChar(); sym = PLUS
     elif ch == '-': getChar(); sym = MINUS
@@ -180,4 +220,53 @@ def getSym():
     elif ch == '&': getChar(); sym = AMP
     elif ch == '|': getChar(); sym = BAR
     elif ch == chr(0): sym = EOF
-    else: mark('illegal character'); getChar(); sym = None
\ No newline at end of file
+    else: mark('illegal character'); getChar(); sym = None
+
+
+'''
+Procedure tokenize(src) recognizes all symbols of src in one pass. The regular expression
+TOKEN matches blanks and comments preceding a symbol, followed by the lexeme of the
+symbol: an identifier or keyword, a number, an operator, a comment that is not terminated 
+before the end of the source, or any other character. The last match consumes the blanks 
+and comments at the end of the source with an empty lexeme, which stands for EOF. As with 
+scanSym(), the source ends at the first chr(0). The symbols are
+looked up by their lexeme in LEXEMES, or else by their first character in FIRST, where
+-1 stands for an illegal character and -2 for an unterminated comment. The result is
+
+-syms, an array with the symbols of src, ending with EOF
+-vals, a list with the lexemes of the symbols, from which getSym() assigns val
+-ends, an array with the index in src following each symbol
+
+Procedure locate(i) assigns to (lastline, lastpos) the location in the source that is
+reported for a symbol ending before index i, which is that of the last character read by
+scanSym(): the character following the symbol, if any, is read ahead.
+'''
+
+LEXEMES = \
+    {'*': TIMES, '+': PLUS, '-': MINUS, '=': EQ, '<>': NE, '<': LT, '<=': LE,
+    '>': GT, '>=': GE, ';': SEMICOLON, ',': COMMA, ':': COLON, ':=': BECOMES,
+    '.': PERIOD, '(': LPAREN, ')': RPAREN, '[': LBRAK, ']': RBRAK, '~': TILDE,
+    '&': AMP, '|': BAR, **KEYWORDS}
+
+FIRST = dict([(c, IDENT) for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'] +
+             [(c, NUMBER) for c in '0123456789'] + [('{', -2)])
+
+TOKEN = re.compile(r'((?:[\x01- ]+|\{[^}]*\})*)'
+                   r'([A-Za-z][A-Za-z0-9]*|[0-9]+|<=|<>|>=|:=|\{[^}]*\Z|[^\x01- ]|\Z)')
+
+def tokenize(src):
+    src = src.partition(chr(0))[0]
+    lexemes = TOKEN.findall(src)
+    if len(lexemes) > 1 and not lexemes[-2][1]: lexemes.pop() #  empty match after the last
+    vals = list(map(itemgetter(1), lexemes)); vals[-1] = chr(0)
+    syms = array('b', map(LEXEMES.get, vals,
+                          map(FIRST.get, map(itemgetter(0), vals), repeat(-1))))
+    syms[-1] = EOF
+    ends = array('i', list(accumulate(map(len, chain.from_iterable(lexemes))))[1::2])
+    return syms, vals, ends
+
+def locate(i):
+    global lastline, lastpos
+    e = i - 1 if i < len(source) else i - 2
+    lastline = source.count('\n', 0, max(e, 0)) + 1
+    lastpos = e - source.rfind('\n', 0, e) if e >= 0 else 0
@@ -105,43 +105,44 @@ class Array:
                str(self.length) + ', base = ' + str(self.base) + ')'
 
 '''
-The symbol table is represented by a list of scopes. Each scope is a list of entries. 
-Each entry has a name, which is assumed to be a string, and the level at which it is declared; 
-the entries on the outermost scope are on level 0 and the level increases with each inner scope.
+The symbol table is represented by a list of scopes, with the innermost scope last. Each scope 
+is a list of entries in the order of their declaration. Each entry has a name, which is assumed 
+to be a string, and the level at which it is declared; the entries on the outermost scope are on 
+level 0 and the level increases with each inner scope. For finding entries by name, the dictionary 
+names maps each name to the stack of pairs (level, entry) of the visible declarations of that name, 
+with the innermost declaration last; as the code generator may change the lev field of an entry, 
+the level of the declaration is kept in the pair. When a scope is closed, its list of entries serves 
+as undo log for names, so that declaring, finding, and closing a scope are each O(1) per entry.
 '''
 
 def init():
-    global symTab
-    symTab = [[]]
+    global symTab, names
+    symTab, names = [[]], {}
 
 def printSymTab():
-    for l in symTab:
+    for l in reversed(symTab):
         for e in l: print(e)
         print()
 
 def newDecl(name, entry):
-    top, entry.lev, entry.name = symTab[0], len(symTab) - 1, name
-    for e in top:
-        if e.name == name:
-            print(e.name)
-            mark("multiple definition"); return
-    top.append(entry)
-    #print(str(entry)+" added to top,,,")
+    top, entry.lev, entry.name = symTab[-1], len(symTab) - 1, name
+    decls = names.setdefault(name, [])
+    if decls and decls[-1][0] == entry.lev:
+        print(name)
+        mark("multiple definition"); return
+    top.append(entry); decls.append((entry.lev, entry))
 
 def find(name):
-    for l in symTab:
-        for e in l:
-            if name == e.name: return e
+    decls = names.get(name)
+    if decls: return decls[-1][1]
     mark('undefined identifier ' + name)
     return Const(None, 0)
 
 def openScope():
-    symTab.insert(0, [])
+    symTab.append([])
 
 def topScope():
-    return symTab[0]
+    return symTab[-1]
 
 def closeScope():
-    #print("poppint : "+str(symTab[0]))
-    symTab.pop(0)
-
+    for e in symTab.pop(): names[e.name].pop()
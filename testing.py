@@ -300,3 +300,641 @@ get_ipython().system('wat2wasm casetest3.wat')
 
 runpywasm('casetest3.wasm')
 
+
+
+# In[29]:
+
+##testing comments at the end of the source and comments that are not terminated
+import P0, SC
+
+def symbols(src, bulk):
+    SC.init(src, bulk); syms = [SC.sym]
+    while SC.sym != SC.EOF: SC.getSym(); syms.append(SC.sym)
+    return syms, SC.error
+
+plain = symbols("program p; begin write(7) end", True)
+for src in ["program p; begin write(7) end {trailing}",
+            "program p; begin write(7) end\n{ end of program }\n\n"]:
+    assert symbols(src, True) == symbols(src, False) == plain
+for src in ["program p; begin write(7) end {not terminated",
+            "program p; begin write(7) {not terminated end"]:
+    assert symbols(src, True) == symbols(src, False)
+    assert symbols(src, True)[1]  #comment not terminated
+
+P0.compileString("""
+program p;
+  begin write(7) end
+{ end of program }
+""", 'trailing.wat', target = 'wat')
+
+
+# In[30]:
+
+##testing incremental compilation and scanning character by character with procedures
+import P0, SC
+
+def program(n):
+    return """
+program p;
+  var g: integer;
+  procedure a(x: integer);
+    begin g := g + x end;
+  procedure b;
+    begin a(""" + str(n) + """); write(g) end;
+  begin
+    b; b; writeln()
+  end
+"""
+
+context = P0.CompilerContext('wasm', incremental = True)
+for n in [1, 2, 2, 3]:
+    assert context.compile(program(n)) == P0.CompilerContext('wasm').compile(program(n))
+
+assert P0.generate(program(1), 'wat', incr = True) != None
+SC.init(program(2), False); P0.ST.init()  #after an incremental compilation
+assert P0.program() != None and not SC.error
+
+
+# In[31]:
+
+##testing the passes of CGast: with each pass alone and with all passes, programs give the same 
+##output as without passes, and as with the wasm target
+import io, P0, CGast
+from pywasm import core
+
+def runAST(src, passes, inputs = (), checks = False):
+    context = P0.CompilerContext('ast', checks = checks)
+    context.module('CGast').passes = passes
+    if context.compile(src) == None: return None
+    code = context.module('CGwasm').assemble()  #encodes the module that CGast lowered through CGwat
+    try: return P0.runModule(core.ModuleDesc.from_reader(io.BytesIO(code)), inputs)
+    except Exception: return 'trap'
+
+def comparePasses(src, expected, inputs = (), checks = False):
+    try: result = P0.run(src, inputs, checks)
+    except Exception: result = 'trap'
+    assert result == expected
+    for passes in [[]] + [[p] for p in CGast.passes] + [CGast.passes]:
+        assert runAST(src, passes, inputs, checks) == expected, passes
+
+
+# In[32]:
+
+##aliasing through var parameters
+comparePasses("""
+program p;
+  type A = array [0 .. 3] of integer;
+  type R = record f, g: integer end;
+  var a, b: A;
+  var r, s: R;
+  var i: integer;
+  procedure reverse(var x, y: A);
+    var i: integer;
+    begin for i := 0 to 3 do x[i] := y[3 - i] end;
+  procedure both(var x: A);
+    begin x[0] := 5; write(a[0]); a[0] := 7; write(x[0]) end;
+  procedure add(var x, y: R);
+    begin x.f := x.f + y.f; y.f := y.f + x.f; y.g := x.f end;
+  begin
+    for i := 0 to 3 do b[i] := i + 1;
+    reverse(a, b); for i := 0 to 3 do write(a[i]);
+    writeln();                                            {writes 4, 3, 2, 1}
+    reverse(a, a); for i := 0 to 3 do write(a[i]);
+    writeln();                                            {writes 1, 2, 2, 1}
+    both(a); both(b); writeln();                          {writes 5, 7, 7, 5}
+    r.f := 1; s.f := 1; add(r, s); write(r.f); write(s.f);
+    add(r, r); write(r.f); write(r.g); writeln()          {writes 2, 3, 8, 8}
+  end
+""", '4321\n1221\n5775\n2388\n')
+
+
+# In[33]:
+
+##globals changed in called procedures inside loops
+comparePasses("""
+program p;
+  var g, s, i: integer;
+  var a: array [0 .. 9] of integer;
+  procedure bump;
+    begin g := g + 1 end;
+  procedure store(k: integer);
+    begin a[k] := g * k end;
+  procedure show;
+    begin write(s); write(g); writeln() end;
+  begin
+    g := 0; s := 0; i := 0;
+    while i < 5 do begin s := s + g; bump; i := i + 1 end;
+    show;                                                 {writes 10, 5}
+    for i := 0 to 9 do begin store(i); if i mod 3 = 0 then bump end;
+    s := 0;
+    for i := 0 to 9 do s := s + a[i];
+    show                                                  {writes 333, 9}
+  end
+""", '105\n3339\n')
+
+
+# In[34]:
+
+##for and downto loops at the limits of integer
+comparePasses("""
+program p;
+  const max = 2147483647;
+  var i, n: integer;
+  begin
+    n := 0;
+    for i := max - 2 to max do begin write(i); n := n + 1 end;
+    writeln();                                            {writes 2147483645 .. 2147483647}
+    for i := 0 - max + 1 downto 0 - max - 1 do begin write(i); n := n + 1 end;
+    writeln();                                            {writes -2147483646 .. -2147483648}
+    for i := max to max - 1 do n := n + 1;
+    for i := 0 - max - 1 downto 0 - max do n := n + 1;
+    write(n); writeln()                                   {writes 6}
+  end
+""", '214748364521474836462147483647\n-2147483646-2147483647-2147483648\n6\n')
+
+
+# In[35]:
+
+##checks of indices at run time
+src = """
+program p;
+  var a: array [1 .. 4] of integer;
+  var i, j: integer;
+  begin
+    read(j);
+    for i := 1 to 4 do a[i] := i * i;
+    for i := 1 to j do write(a[i]);
+    i := 0;
+    while i < j do begin i := i + 1; write(a[j + 1 - i]) end
+  end
+"""
+comparePasses(src, '149941', [3], True)                 #writes 1, 4, 9, 9, 4, 1
+comparePasses(src, '1491616941', [4], True)             #writes 1, 4, 9, 16, 16, 9, 4, 1
+comparePasses(src, 'trap', [5], True)                   #a[5] is out of bounds, but in memory
+comparePasses(src, '', [0 - 1], True)                   #writes nothing
+comparePasses("""
+program p;
+  var a: array [1 .. 4] of integer;
+  var i: integer;
+  procedure put(k: integer);
+    begin a[k] := k end;
+  begin
+    for i := 1 to 5 do put(i);                            {a[5] is out of bounds}
+    write(a[1])
+  end
+""", 'trap', [], True)
+comparePasses("""
+program p;
+  var a: array [1 .. 4] of integer;
+  var i: integer;
+  procedure next;
+    begin i := i + 4 end;
+  begin
+    i := 1; write(a[i]); next;
+    write(a[i])                                           {a[5] is out of bounds}
+  end
+""", 'trap', [], True)
+
+
+# In[36]:
+
+##indices changed in called procedures, for common subexpressions and strength reduction
+comparePasses("""
+program p;
+  var a: array [0 .. 9] of integer;
+  var i, s: integer;
+  procedure skip;
+    begin i := i + 1 end;
+  begin
+    i := 1; a[i] := 5; skip;
+    a[i] := a[i] + a[i - 1]; write(a[i]); writeln();     {writes 5}
+    i := 0;
+    while i < 8 do begin a[i] := i + 1; skip; i := i + 1 end;
+    s := 0;
+    for i := 0 to 9 do begin write(a[i]); s := s + a[i] end;
+    write(s); writeln()                                   {writes 1, 5, 3, 0, 5, 0, 7, 0, 0, 0, 21}
+  end
+""", '5\n153050700021\n')
+
+
+# In[37]:
+
+##indices with a negative variable part: the constant part of the address is not moved to 
+##the offset of loads and stores, as that would trap
+src = """
+program p;
+  type A = array [0 .. 3] of integer;
+  var a: A;
+  var i, x: integer;
+  procedure q(var v: A; n: integer);
+    begin v[n + 2] := 6; write(v[n + 2]) end;
+  begin
+    i := 0 - 1; a[i + 1] := 5; write(a[i + 1]);           {writes 5}
+    x := 0 - 2; a[x + 4 - 2] := 7; write(a[x + 4 - 2]);   {writes 7}
+    q(a, 0 - 1); write(a[1])                              {writes 6, 6}
+  end
+"""
+comparePasses(src, '5766')
+comparePasses(src, '5766', [], True)
+
+
+# In[38]:
+
+##case statement over a boolean expression, whose value is held in a temporary variable
+comparePasses("""
+program p;
+  var x: integer;
+  begin
+    x := 5;
+    case x > 3 of true: write(1); false: write(0) end;   {writes 1}
+    case x > 7 of true: write(1); false: write(0) end     {writes 0}
+  end
+""", '10')
+
+
+# In[39]:
+
+##binary modules: the wasm target produces a module that runs without wat2wasm
+import io, P0
+from pywasm import core
+
+code = P0.CompilerContext('wasm').compile("""
+program p;
+  var x: integer;
+  var a: array [1 .. 3] of integer;
+  procedure q(n: integer);
+    begin write(n + 1) end;
+  begin
+    read(x); a[2] := x * 2; q(a[2]);                      {writes 43}
+    if x > 20 then write(1) else write(0);                {writes 1}
+    writeln()
+  end
+""")
+assert code[:8] == b'\0asm\1\0\0\0'
+assert P0.runModule(core.ModuleDesc.from_reader(io.BytesIO(code)), [21]) == '431\n'
+
+
+# In[40]:
+
+##the compilation cache: keys, entries, replacing an entry and eviction
+import os, tempfile, P0
+
+cache = P0.CompileCache(tempfile.mkdtemp())
+src = "program p; begin write(7) end"
+key = cache.key(src, 'wat', (False, False, False))
+assert key == cache.key(src, 'wat', (False, False, False))
+assert key != cache.key(src, 'wasm', (False, False, False))
+assert key != cache.key(src, 'wat', (True, False, False))
+assert key != cache.key(src + ' ', 'wat', (False, False, False))
+assert cache.get(key) == None
+
+code = P0.CompilerContext('wat', cache = cache).compile(src)
+assert cache.get(key) == (code, [])
+assert P0.CompilerContext('wat', cache = cache).compile(src) == code  #taken from the cache
+for i in range(3): cache.put(key, code, [])                           #replaces the entry
+assert cache.size == sum(size for t, size, fn in cache.entries())
+
+cache.maxsize = 4 * cache.size
+for n in range(10):
+    P0.CompilerContext('wat', echo = False, cache = cache).compile(src + '{' + str(n) + '}')
+assert cache.size <= cache.maxsize
+assert cache.size == sum(size for t, size, fn in cache.entries())
+assert cache.get(cache.key(src + '{9}', 'wat', (False, False, False))) != None  #most recent
+
+
+# In[41]:
+
+##the symbol table: a declaration in an inner scope hides one of the same name in an outer 
+##scope until the inner scope is closed, and scopes keep their declarations in order
+import SC, ST
+
+SC.init(''); ST.init()
+x, y = ST.Var(ST.Int), ST.Var(ST.Bool)
+ST.newDecl('x', x); ST.newDecl('y', y)
+assert ST.find('x') is x and ST.topScope() == [x, y]
+ST.openScope()
+z = ST.Var(ST.Bool); ST.newDecl('x', z)
+assert ST.find('x') is z and ST.find('y') is y and z.lev == 1 and ST.topScope() == [z]
+ST.closeScope()
+assert ST.find('x') is x and ST.topScope() == [x, y] and not SC.error
+ST.newDecl('y', ST.Var(ST.Int))                           #multiple definition
+assert SC.error and ST.find('y') is y
+
+SC.init(''); ST.init()
+for n in range(2000): ST.newDecl('v' + str(n), ST.Var(ST.Int))
+assert [e.name for e in ST.topScope()] == ['v' + str(n) for n in range(2000)]
+ST.find('v2000')                                          #undefined identifier
+assert SC.error
+
+
+# In[42]:
+
+##compiling concurrently: each CompilerContext has its own scanner, symbol table and code 
+##generator, so compilations in threads give the same code and messages as one after another
+import P0
+from concurrent.futures import ThreadPoolExecutor
+
+def source(n):
+    return """
+program p;
+  var a: array [1 .. """ + str(n) + """] of integer;
+  var i: integer;
+  procedure q""" + str(n) + """(k: integer);
+    begin write(k * """ + str(n) + """) end;
+  begin
+    for i := 1 to """ + str(n) + """ do begin a[i] := i; q""" + str(n) + """(a[i]) end;
+    """ + ('write(true)' if n % 5 == 0 else 'writeln()') + """
+  end
+"""
+
+def compileWat(src):
+    context = P0.CompilerContext('wat', echo = False)
+    return context.compile(src), context.messages
+
+sources = [source(n) for n in range(1, 41)]
+sequential = [compileWat(src) for src in sources]
+with ThreadPoolExecutor(8) as pool: concurrent = list(pool.map(compileWat, sources))
+assert concurrent == sequential
+assert [p == None for p, messages in sequential] == [n % 5 == 0 for n in range(1, 41)]
+
+
+# In[43]:
+
+##compiling many files: compileMany returns a CompileResult per file, in the order of the 
+##files, with one or several worker processes; main is the command line
+import os, tempfile, P0
+
+folder = tempfile.mkdtemp()
+srcfns = []
+for n in range(12):
+    srcfns.append(os.path.join(folder, 'f' + str(n) + '.p'))
+    with open(srcfns[-1], 'w') as f:
+        f.write('program p; begin write(' + ('true' if n == 7 else str(n)) + ') end')
+srcfns.append(os.path.join(folder, 'g.txt'))
+
+for jobs in [1, 3]:
+    results = P0.compileMany(srcfns, 'wasm', jobs)
+    assert [r.srcfn for r in results] == srcfns
+    assert [r.dstfn for r in results] == \
+           [fn[:-2] + '.wasm' if n != 7 else None for n, fn in enumerate(srcfns[:-1])] + [None]
+    assert results[7].messages and results[-1].messages == ["'.p' file extension expected"]
+    assert all(r.time >= 0 for r in results)
+    with open(results[0].dstfn, 'rb') as f: assert f.read()[:4] == b'\0asm'
+
+assert P0.main(['-j', '2'] + srcfns[:7]) == 0                 #all compiled
+assert P0.main(['-t', 'wasm'] + srcfns) == 1                  #errors in f7.p and g.txt
+
+
+# In[44]:
+
+##local variables of for and case statements are declared at the start of the function in 
+##which the statements are
+import P0
+
+src = """
+program p;
+  var i: integer;
+  procedure q(n: integer);
+    var k: integer;
+    begin
+      for k := 1 to n + 1 do write(k);
+      case n * 2 of 2: write(10); 4: write(20) else write(30) end
+    end;
+  begin
+    for i := 1 to 2 do q(i);                              {writes 1, 2, 10, 1, 2, 3, 20}
+    case i + 1 of 1: write(1) else write(0) end;          {writes 0}
+    writeln()
+  end
+"""
+wat = P0.CompilerContext('wat').compile(src)
+funcs = {f.split()[0]: f.split('\n')[1:] for f in wat.split('(func $')[1:]}
+for name, lines in funcs.items():
+    n = sum(1 for l in lines if l.startswith('(local'))
+    assert all(l.startswith('(local') for l in lines[:n]), name
+    assert not any(l.startswith('(local') for l in lines[n:]), name
+assert sum(l.startswith('(local') for l in funcs['q']) == 3    #k and the temporary variables
+assert P0.run(src) == '1210123200\n'
+
+
+# In[45]:
+
+##counted loops: the code does not depend on the number of iterations, and the bounds can be 
+##read at run time
+import P0
+
+def loop(n):
+    return """
+program p;
+  var i, s: integer;
+  begin
+    s := 0;
+    for i := 1 to """ + n + """ do s := s + i;
+    write(s)
+  end
+"""
+assert len(P0.CompilerContext('wat').compile(loop('1000000'))) == \
+       len(P0.CompilerContext('wat').compile(loop('1000009')))
+assert 'data' not in P0.CompilerContext('wat').compile(loop('1000000'))
+
+src = """
+program p;
+  var i, j, lo, hi: integer;
+  begin
+    read(lo); read(hi);
+    for i := lo to hi do write(i);
+    writeln();
+    for i := hi downto lo do for j := i to hi do write(j);
+    writeln()
+  end
+"""
+assert P0.run(src, [3, 5]) == '345\n545345\n'
+assert P0.run(src, [5, 3]) == '\n\n'                      #no iterations
+assert P0.run(src, [0 - 2, 0 - 2]) == '-2\n-2\n'
+
+
+# In[46]:
+
+##case statements: dense labels are dispatched by br_table, sparse labels by comparisons
+import P0
+
+def cases(labels):
+    return """
+program p;
+  var x: integer;
+  begin
+    while x <> 0 - 1 do begin
+      read(x);
+      case x of """ + '; '.join(str(l) + ': write(' + str(l) + ')' for l in labels) + """
+      else write(0 - 1) end
+    end
+  end
+"""
+dense, sparse = list(range(10, 60)), [1, 7, 100, 1000, 5000, 70000]
+assert 'br_table' in P0.CompilerContext('wat').compile(cases(dense))
+assert 'br_table' not in P0.CompilerContext('wat').compile(cases(sparse))
+for labels in [dense, sparse]:
+    inputs = [l + d for l in labels for d in (-1, 0, 1)] + [0 - 1]
+    expected = ''.join(str(x if x in labels else 0 - 1) for x in inputs)
+    assert P0.run(cases(labels), inputs) == expected
+
+
+# In[47]:
+
+##constant lists of for-in loops are placed in data segments, one for identical lists
+import P0
+
+src = """
+program p;
+  var x: integer;
+  procedure q;
+    var y: integer;
+    begin for y in [1, 3, 5] do write(y) end;
+  begin
+    for x in [1, 3, 5] do write(x);                       {writes 1, 3, 5}
+    q; q;                                                 {writes 1, 3, 5, 1, 3, 5}
+    for x in [5, 3, 1] do write(x);                       {writes 5, 3, 1}
+    writeln()
+  end
+"""
+wat = P0.CompilerContext('wat').compile(src)
+assert wat.count('(data ') == 2 and 'i32.store' not in wat
+assert P0.run(src) == '135135135531\n'
+
+
+# In[48]:
+
+##the peephole optimizer: the rules change the code, but not the output
+import io, P0
+from pywasm import core
+
+src = """
+program p;
+  type R = record f, g: integer end;
+  type A = array [1 .. 8] of integer;
+  var a: A;
+  var r: R;
+  var i, x: integer;
+  procedure q(var s: R; var b: A; n: integer);
+    var k: integer;
+    begin
+      s.g := n; write(s.g); k := n; write(k);
+      b[2] := 0 - n; write(b[2] * 8)
+    end;
+  begin
+    read(x);
+    i := 2; a[i - 1] := x * 4 * 2; write(a[i - 1]);
+    a[(i + 1) * 2] := ~x; write(a[(i + 1) * 2]); write(a[((i - 1) * 2 + 1) * 2]);
+    write(0 - x); write(x - 3); write(x + 0); write(x * 1);
+    q(r, a, x); write(r.g); writeln()
+  end
+"""
+def optimized(optimize):
+    context = P0.CompilerContext('wasm'); context.module('CGwat').optimize = optimize
+    return context.compile(src), context.module('CGwat').fired
+
+code, fired = optimized(True)
+plain, none = optimized(False)
+assert len(code) < len(plain) and not any(none.values())
+assert all(fired[n] > 0 for n in fired if n != 'foldConst')
+for x in [5, 0 - 7]:
+    assert P0.runModule(core.ModuleDesc.from_reader(io.BytesIO(code)), [x]) == \
+           P0.runModule(core.ModuleDesc.from_reader(io.BytesIO(plain)), [x])
+
+
+# In[49]:
+
+##the intermediate representation: each function keeps its instructions as opcodes and 
+##operands, from which both the textual and the binary module are produced
+import io, P0
+from array import array
+from pywasm import core
+
+src = """
+program p;
+  var x, y: integer;
+  procedure q(n: integer);
+    begin if n > 2 then write(n) else write(0 - n) end;
+  begin
+    read(x); y := 1;
+    while y <= x do begin q(y); y := y + 1 end;
+    writeln()
+  end
+"""
+context = P0.CompilerContext('wat')
+wat, cg = context.compile(src), context.module('CGwat')
+assert [f.name for f in cg.funcs] == ['q', 'program']
+for f in cg.funcs:
+    assert type(f.ops) == type(f.args) == array and len(f.ops) == len(f.args)
+    assert [cg.instruction(f, i) for i in range(len(f.ops))] == \
+           [l for l in cg.funcText(f).split('\n') if l[0] not in '()']
+code = context.module('CGwasm').assemble()
+assert P0.runModule(core.ModuleDesc.from_reader(io.BytesIO(code)), [4]) == '-1-234\n'
+assert code == P0.CompilerContext('wasm').compile(src)
+
+
+# In[50]:
+
+##buffered output: the output is formatted in memory and passed to flush, also when it is 
+##longer than the buffer, and is the same as with write and writeln
+import P0
+
+src = """
+program p;
+  var i: integer;
+  begin
+    write(0); write(0 - 2147483647 - 1); write(2147483647); writeln();
+    for i := 0 - 1000 to 1000 do begin write(i * 1001); writeln() end
+  end
+"""
+wat = P0.CompilerContext('wat', buffered = True).compile(src)
+assert '"flush"' in wat and '"write"' not in wat and '"writeln"' not in wat
+output = P0.run(src, buffered = True)
+assert len(output) > 4096 and output == P0.run(src)
+assert output.startswith('0-21474836482147483647\n-1001000\n')
+assert P0.run("program p; begin end", buffered = True) == ''
+
+
+# In[51]:
+
+##prefetched input: the inputs are copied to memory before the program starts and read from 
+##there, with the same result as calling read; reading past the inputs traps
+import P0
+
+src = """
+program p;
+  var n, i, x, s: integer;
+  var a: array [0 .. 9] of integer;
+  begin
+    read(n); s := 0;
+    for i := 1 to n do begin read(x); s := s + x; a[i mod 10] := x end;
+    write(s); write(a[n mod 10]); writeln()
+  end
+"""
+wat = P0.CompilerContext('wat', prefetch = True).compile(src)
+assert '"input"' in wat and '"read"' not in wat
+inputs = [2000] + list(range(0 - 1000, 1000))
+assert P0.run(src, inputs, prefetch = True) == P0.run(src, inputs) == '-1000' + '999\n'
+assert P0.run(src, [0], prefetch = True) == '00\n'
+try: P0.run(src, [3, 1, 2], prefetch = True); trapped = False
+except Exception: trapped = True                          #no more input
+assert trapped
+
+
+# In[52]:
+
+##running programs in memory: decoded modules are cached by source and options, and evicted 
+##when the cache is full
+import P0
+
+P0.runCache.clear()
+src = "program p; var x: integer; begin read(x); write(x * x) end"
+assert P0.run(src, [7]) == '49' and len(P0.runCache) == 1
+desc = P0.loadModule(src, False, False, False)
+assert P0.run(src, [8]) == '64' and P0.loadModule(src, False, False, False) is desc
+assert P0.run(src, [9], checks = True) == '81' and len(P0.runCache) == 2
+assert P0.run("program p; begin write(true) end") == None and len(P0.runCache) == 2
+
+for n in range(P0.RUNCACHE):
+    assert P0.run('program p; begin write(' + str(n) + ') end') == str(n)
+assert len(P0.runCache) == P0.RUNCACHE
+assert P0.loadModule(src, False, False, False) is not desc  #the least recently used is evicted